@@ -12,9 +12,13 @@ def _get_int(name: str, default: int) -> int:
 @dataclass(frozen=True)
 class AccessSyncConfig:
     interval_seconds: int
+    notify_batch_max: int
+    notify_consumers: int
 
 
 def load_config() -> AccessSyncConfig:
     return AccessSyncConfig(
         interval_seconds=_get_int("ACCESS_SYNC_INTERVAL_SECONDS", 60),
+        notify_batch_max=max(1, _get_int("ACCESS_SYNC_NOTIFY_BATCH_MAX", 256)),
+        notify_consumers=max(1, _get_int("ACCESS_SYNC_NOTIFY_CONSUMERS", 2)),
     )
@@ -1,14 +1,17 @@
 import asyncio
 import os
 import signal
-import psycopg
 
-from common.db import init_db_engine
+from common.db import close_engine, init_db_engine, make_dsn
+from common.listener import NotifyPump
 from common.logger import Level, Logger
 from common.xui_client.registry import Manager
 from access_sync.config import load_config
 from access_sync.service import AccessSyncService
 
+SUBSCRIPTIONS_CHANNEL = "subscriptions_changed"
+SERVERS_CHANNEL = "servers_changed"
+
 
 def main() -> None:
     Logger.configure("access-sync", level=Level.INFO)
@@ -21,39 +24,26 @@ def main() -> None:
     cfg = load_config()
     service = AccessSyncService(Manager(), interval_seconds=cfg.interval_seconds)
 
-    async def _listen_loop(stop_event: asyncio.Event, retry_delay: int) -> None:
-        db_host = os.environ.get("DB_HOST", "localhost")
-        db_port = os.environ.get("DB_PORT", "5432")
-        db_name = os.environ.get("DB_NAME", "app")
-        db_user = os.environ["VPN_SUBSCRIPTION_DB_USERNAME"]
-        db_password = os.environ["VPN_SUBSCRIPTION_DB_PASSWORD"]
-        dsn = f"dbname={db_name} user={db_user} password={db_password} host={db_host} port={db_port}"
+    pump = NotifyPump(
+        make_dsn(
+            os.environ["VPN_SUBSCRIPTION_DB_USERNAME"],
+            os.environ["VPN_SUBSCRIPTION_DB_PASSWORD"],
+        ),
+        [SUBSCRIPTIONS_CHANNEL, SERVERS_CHANNEL],
+        retry_delay=max(1, int(cfg.interval_seconds)),
+    )
 
-        while not stop_event.is_set():
+    async def _consume_loop() -> None:
+        while True:
+            batch = await pump.get_batch(cfg.notify_batch_max)
+            if any(n.channel == SERVERS_CHANNEL for n in batch):
+                service.mark_servers_changed()
             try:
-                async with await psycopg.AsyncConnection.connect(dsn, autocommit=True) as conn:
-                    await conn.execute("LISTEN subscriptions_changed")
-                    Logger.info("Access sync: listening for subscription changes")
-
-                    notify_iter = conn.notifies()
-                    while not stop_event.is_set():
-                        notify_task = asyncio.create_task(anext(notify_iter))
-                        stop_task = asyncio.create_task(stop_event.wait())
-                        done, pending = await asyncio.wait(
-                            {notify_task, stop_task},
-                            return_when=asyncio.FIRST_COMPLETED,
-                        )
-                        for task in pending:
-                            task.cancel()
-
-                        if stop_task in done:
-                            break
-
-                        notify = notify_task.result()
-                        await service.handle_notification(getattr(notify, "payload", None))
+                await service.handle_notifications(
+                    n.payload for n in batch if n.channel == SUBSCRIPTIONS_CHANNEL
+                )
             except Exception:
-                Logger.exception("Access sync listen failed")
-                await asyncio.sleep(retry_delay)
+                Logger.exception("Access sync notification handling failed")
 
     async def _periodic_loop(stop_event: asyncio.Event) -> None:
         while not stop_event.is_set():
@@ -73,15 +63,18 @@ def main() -> None:
             loop.add_signal_handler(sig, stop_event.set)
 
         await service.run_once()
-        periodic_task = asyncio.create_task(_periodic_loop(stop_event))
+        tasks = [
+            asyncio.create_task(_periodic_loop(stop_event)),
+            asyncio.create_task(pump.run()),
+            *(asyncio.create_task(_consume_loop()) for _ in range(cfg.notify_consumers)),
+        ]
         try:
-            await _listen_loop(stop_event, max(1, int(cfg.interval_seconds)))
+            await stop_event.wait()
         finally:
-            periodic_task.cancel()
-            try:
-                await periodic_task
-            except asyncio.CancelledError:
-                pass
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await close_engine()
 
     asyncio.run(_run())
 
@@ -3,6 +3,8 @@ from __future__ import annotations
 import asyncio
 import json
 import uuid
+from functools import partial
+from typing import Awaitable, Callable, Iterable
 
 from common.db import db_call
 from common.logger import Logger
@@ -11,9 +13,36 @@ from common.xui_client.registry import Manager
 
 
 class AccessSyncService:
+    SYNC_CONCURRENCY = 20
+    SYNC_TIMEOUT_SECONDS = 30
+    # полная сверка с серверами (list_user_ids) — раз в N прогонов,
+    # в остальные прогоны множество ведётся по собственным sync/del
+    RECONCILE_EVERY = 10
+
     def __init__(self, manager: Manager, *, interval_seconds: int) -> None:
         self._manager = manager
         self._interval_seconds = max(60, int(interval_seconds))
+        self._sync_sem = asyncio.Semaphore(self.SYNC_CONCURRENCY)
+        # при старте синхронизируемся обязательно; дальше — по NOTIFY servers_changed
+        # (плюс собственная почасовая синхронизация Manager)
+        self._servers_dirty = True
+        self._known_server_ids: set[uuid.UUID] | None = None
+        self._runs = 0
+        # user_id -> нужен ли повторный прогон после текущего
+        self._inflight: dict[uuid.UUID, bool] = {}
+
+    def mark_servers_changed(self) -> None:
+        self._servers_dirty = True
+
+    async def _guarded(self, what: str, call: Callable[[], Awaitable[object]]) -> None:
+        # общий лимит параллельных синхронизаций (xui HTTP + DB pool) и таймаут на вызов;
+        # ошибка одного вызова только логируется и не отменяет соседние задачи TaskGroup
+        try:
+            async with self._sync_sem:
+                async with asyncio.timeout(self.SYNC_TIMEOUT_SECONDS):
+                    await call()
+        except Exception as e:
+            Logger.warning("%s partial failure: %r", what, e)
 
     async def run_once(self) -> None:
         Logger.info("Access sync: starting run")
@@ -21,19 +50,31 @@ class AccessSyncService:
         active_ids = {u.id for u in active_users}
         Logger.info("Access sync: %d active user(s) in DB", len(active_ids))
 
-        await self._manager.sync_servers_now()
+        reconcile = self._known_server_ids is None or self._runs % self.RECONCILE_EVERY == 0
+        self._runs += 1
+
+        if self._servers_dirty:
+            self._servers_dirty = False
+            try:
+                await self._manager.sync_servers_now()
+            except Exception:
+                self._servers_dirty = True
+                raise
+            # новые/изменённые серверы — состав пользователей на них неизвестен
+            reconcile = True
 
         if active_users:
-            results = await asyncio.gather(
-                *(self._manager.sync_user(u) for u in active_users),
-                return_exceptions=True,
-            )
-            for r in results:
-                if isinstance(r, Exception):
-                    Logger.warning("sync_user partial failure: %s", r)
-
-        server_ids = await self._manager.list_user_ids()
-        Logger.info("Access sync: %d user(s) on servers", len(server_ids))
+            async with asyncio.TaskGroup() as tg:
+                for u in active_users:
+                    tg.create_task(self._guarded("sync_user", partial(self._manager.sync_user, u)))
+
+        if reconcile:
+            server_ids = await self._manager.list_user_ids()
+            self._known_server_ids = server_ids | active_ids
+            Logger.info("Access sync: %d user(s) on servers", len(server_ids))
+        else:
+            self._known_server_ids |= active_ids
+            server_ids = self._known_server_ids
         stale_ids = server_ids - active_ids
 
         if not stale_ids:
@@ -43,20 +84,19 @@ class AccessSyncService:
         stale_users = await db_call(lambda db: db.users.by_ids(stale_ids))
         stale_map = {u.id: u for u in stale_users}
 
-        tasks = []
-        for user_id in stale_ids:
-            user = stale_map.get(user_id)
-            if user:
-                display_name = user.full_name or user.username or str(user.tg_user_id)
-            else:
-                display_name = str(user_id)
-            Logger.info("Access sync: removing stale user %s (id=%s)", display_name, user_id)
-            tasks.append(self._manager.del_user_id(user_id, display_name=display_name))
-
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        for r in results:
-            if isinstance(r, Exception):
-                Logger.warning("del_user_id partial failure: %s", r)
+        async with asyncio.TaskGroup() as tg:
+            for user_id in stale_ids:
+                user = stale_map.get(user_id)
+                if user:
+                    display_name = user.full_name or user.username or str(user.tg_user_id)
+                else:
+                    display_name = str(user_id)
+                Logger.info("Access sync: removing stale user %s (id=%s)", display_name, user_id)
+                tg.create_task(self._guarded(
+                    "del_user_id",
+                    partial(self._manager.del_user_id, user_id, display_name=display_name),
+                ))
+        self._known_server_ids -= stale_ids
 
         Logger.info(
             "Access sync: done — %d active, %d removed",
@@ -65,32 +105,68 @@ class AccessSyncService:
         )
 
     async def handle_notification(self, payload: str | None) -> None:
-        if not payload:
+        await self.handle_notifications([payload])
+
+    async def handle_notifications(self, payloads: Iterable[str | None]) -> None:
+        """Обработать пачку NOTIFY: повторы по одному user_id схлопываются в одну синхронизацию."""
+        user_ids: set[uuid.UUID] = set()
+        received = 0
+        for payload in payloads:
+            received += 1
+            user_id = self._parse_user_id(payload)
+            if user_id is not None:
+                user_ids.add(user_id)
+
+        if not user_ids:
             return
+        if received > len(user_ids):
+            Logger.debug("Access sync: %d notification(s) coalesced into %d user(s)", received, len(user_ids))
+
+        async with asyncio.TaskGroup() as tg:
+            for uid in user_ids:
+                tg.create_task(self._sync_user_coalesced(uid))
+
+    async def _sync_user_coalesced(self, user_id: uuid.UUID) -> None:
+        # если синхронизация этого пользователя уже идёт — только помечаем,
+        # что после неё нужен ещё один проход (N повторных NOTIFY -> не больше 2 прогонов)
+        if user_id in self._inflight:
+            self._inflight[user_id] = True
+            return
+
+        self._inflight[user_id] = False
         try:
-            data = json.loads(payload)
-            user_id = uuid.UUID(str(data.get("user_id")))
+            while True:
+                await self._guarded("Access sync: notification sync", partial(self._sync_user_id, user_id))
+                if not self._inflight[user_id]:
+                    break
+                self._inflight[user_id] = False
+        finally:
+            del self._inflight[user_id]
+
+    @staticmethod
+    def _parse_user_id(payload: str | None) -> uuid.UUID | None:
+        if not payload:
+            return None
+        try:
+            # payload строит наш же триггер: {"user_id" : "<uuid>"}
+            return uuid.UUID(json.loads(payload)["user_id"])
         except Exception:
             Logger.warning("Access sync: invalid payload %r", payload)
-            return
-
-        await self._sync_user_id(user_id)
+            return None
 
     async def _sync_user_id(self, user_id: uuid.UUID) -> None:
-        has_active = await db_call(lambda db: db.subscriptions.has_active(user_id))
-        user = await db_call(lambda db: db.users.get(user_id))
+        user, has_active, pending_free_trial = await db_call(lambda db: db.users.access_state(user_id))
 
         if has_active and user is not None:
             await self._manager.sync_user(user)
+            self._note_on_servers(user_id, True)
             return
 
-        pending_free_trial = await db_call(
-            lambda db: db.subscriptions.pending_free_or_trial_for_user(user_id)
-        )
         if pending_free_trial:
             if user is not None:
                 Logger.info("Access sync: pending free/trial for user %s, syncing", user_id)
                 await self._manager.sync_user(user)
+                self._note_on_servers(user_id, True)
             else:
                 Logger.info("Access sync: pending free/trial for user %s, user not found", user_id)
             return
@@ -100,3 +176,12 @@ class AccessSyncService:
         else:
             display_name = str(user_id)
         await self._manager.del_user_id(user_id, display_name=display_name)
+        self._note_on_servers(user_id, False)
+
+    def _note_on_servers(self, user_id: uuid.UUID, present: bool) -> None:
+        if self._known_server_ids is None:
+            return
+        if present:
+            self._known_server_ids.add(user_id)
+        else:
+            self._known_server_ids.discard(user_id)
@@ -0,0 +1 @@
+"""Tests for access_sync."""
@@ -0,0 +1,82 @@
+import asyncio
+import json
+import logging
+import unittest
+import uuid
+
+from access_sync.service import AccessSyncService
+from common.logger import Logger, Level
+
+
+def _payload(user_id: uuid.UUID) -> str:
+    return json.dumps({"user_id": str(user_id)})
+
+
+class AccessSyncServiceTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        # Logger.configure() можно вызвать только раз за процесс — подменяем логгер на время тестов
+        cls._prev_logger = Logger._logger
+        Logger._logger = logging.getLogger("access-sync-test")
+        Logger._logger.setLevel(Level.CRITICAL)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        Logger._logger = cls._prev_logger
+
+    async def test_handle_notifications_coalesces_duplicates(self) -> None:
+        synced = []
+
+        class TestService(AccessSyncService):
+            async def _sync_user_id(self, user_id):
+                synced.append(user_id)
+
+        service = TestService(manager=None, interval_seconds=60)
+        u1, u2 = uuid.uuid4(), uuid.uuid4()
+
+        await service.handle_notifications(
+            [_payload(u1), _payload(u2), _payload(u1), None, "not-json", _payload(u1)]
+        )
+
+        self.assertEqual(sorted(synced), sorted([u1, u2]))
+
+    async def test_handle_notifications_isolates_failures(self) -> None:
+        synced = []
+        bad = uuid.uuid4()
+        good = uuid.uuid4()
+
+        class TestService(AccessSyncService):
+            async def _sync_user_id(self, user_id):
+                if user_id == bad:
+                    raise RuntimeError("boom")
+                synced.append(user_id)
+
+        service = TestService(manager=None, interval_seconds=60)
+        await service.handle_notifications([_payload(bad), _payload(good)])
+
+        self.assertEqual(synced, [good])
+
+    async def test_inflight_duplicates_collapse_into_one_rerun(self) -> None:
+        runs = []
+        release = asyncio.Event()
+        uid = uuid.uuid4()
+
+        class TestService(AccessSyncService):
+            async def _sync_user_id(self, user_id):
+                runs.append(user_id)
+                await release.wait()
+
+        service = TestService(manager=None, interval_seconds=60)
+        first = asyncio.create_task(service.handle_notifications([_payload(uid)]))
+        await asyncio.sleep(0)
+        # пока первый прогон идёт, приходят ещё два NOTIFY по тому же пользователю
+        await service.handle_notifications([_payload(uid)])
+        await service.handle_notifications([_payload(uid)])
+        release.set()
+        await first
+
+        self.assertEqual(runs, [uid, uid])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -41,51 +41,66 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     context.user_data.pop("awaiting_broadcast", None)
 
-    users = await db.db_call(lambda db: db.users.all())
-    user_ids: list[int] = [u.tg_user_id for u in users]
-    ok = 0
-    fail = 0
+    total: int = await db.db_call(lambda db: db.users.count())
 
     await update.message.reply_text(
-        f"Начинаю рассылку по {len(users)} пользователям…"
+        f"Начинаю рассылку по {total} пользователям…"
     )
 
     SEM_LIMIT = 20  # 10–30 безопасно
-
-    sem = asyncio.Semaphore(SEM_LIMIT)
+    PAGE_SIZE = 500
 
     ok = 0
     fail = 0
-    lock = asyncio.Lock()  # защита счётчиков
 
     async def send(uid: int):
         nonlocal ok, fail
-        async with sem:
-            retries = 0
-            while True:
-                try:
-                    await context.bot.send_message(uid, text)
-                    async with lock:
-                        ok += 1
+        retries = 0
+        while True:
+            try:
+                await context.bot.send_message(uid, text)
+                ok += 1
+                break
+            except RetryAfter as e:
+                # анти-флуд: ждём столько, сколько просит Telegram
+                retries += 1
+                if retries >= 3:
+                    fail += 1
                     break
-                except RetryAfter as e:
-                    retries += 1
-                    if retries >= 3:
-                        async with lock:
-                            fail += 1
-                        break
-                    await asyncio.sleep(e.retry_after + 1)
-                    continue
-                except Exception as e:
-                    Logger.error("Error while sending broadcast message to \"%s\": \"%s\"", uid, e)
-                    async with lock:
-                        fail += 1
-                    break
-                finally:
-                    await asyncio.sleep(0.03)  # анти-флуд
-
-    tasks = [asyncio.create_task(send(uid)) for uid in user_ids]
-    await asyncio.gather(*tasks)
+                await asyncio.sleep(e.retry_after + 1)
+                continue
+            except Exception as e:
+                Logger.error("Error while sending broadcast message to \"%s\": \"%s\"", uid, e)
+                fail += 1
+                break
+
+    # получатели читаются страницами и идут через ограниченную очередь:
+    # в памяти не больше PAGE_SIZE id и SEM_LIMIT отправок одновременно
+    queue: asyncio.Queue[int | None] = asyncio.Queue(maxsize=SEM_LIMIT * 2)
+
+    async def worker():
+        while True:
+            uid = await queue.get()
+            if uid is None:
+                return
+            await send(uid)
+
+    workers = [asyncio.create_task(worker()) for _ in range(SEM_LIMIT)]
+    try:
+        after: int | None = None
+        while True:
+            page: list[int] = await db.db_call(
+                lambda db: db.users.tg_ids_page(after=after, limit=PAGE_SIZE)
+            )
+            for uid in page:
+                await queue.put(uid)
+            if len(page) < PAGE_SIZE:
+                break
+            after = page[-1]
+    finally:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
 
     await update.message.reply_text(
         f"Готово ✅\nУспешно: {ok}\nОшибок: {fail}"
@@ -1,14 +1,15 @@
-from datetime import datetime, timezone, timedelta
+import asyncio
+from dataclasses import dataclass
 import uuid
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from sqlalchemy import select, update as sa_update
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import select
 
 from bot.actions import return_main_menu, settings
-from bot.helpers import helpers
+from bot.helpers import helpers, plans
 from common.db import db_call
-from common.models import Plan, Subscription
+from common.logger import Logger
+from common.models import Plan, Subscription, User
 
 from telegram.constants import ParseMode
 
@@ -16,10 +17,9 @@ HTML = ParseMode.HTML
 
 
 async def show_plans(query, context: ContextTypes.DEFAULT_TYPE) -> None:
-    plans = await db_call(lambda db: db.plans.active())
-    plans = [p for p in plans if p.code != "free" and p.code != "trial"]
+    snapshot = await plans.available_plans()
 
-    if not plans:
+    if not snapshot.plans:
         await helpers.safe_edit(
             query,
             text="Доступных подписок сейчас нет.",
@@ -28,37 +28,18 @@ async def show_plans(query, context: ContextTypes.DEFAULT_TYPE) -> None:
         )
         return
 
-    rows = [
-        [InlineKeyboardButton(f"{p.title} — {p.price_rub} ₽", callback_data=f"plan:{p.code}")]
-        for p in plans
-    ]
-    rows.append([InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main")])
-
     await helpers.safe_edit(
         query,
         text="Выберите подписку:",
-        reply_markup=InlineKeyboardMarkup(rows),
+        reply_markup=snapshot.choose_markup,
         parse_mode=HTML,
     )
 
 
-async def _find_free_amount(db, base_minor: int) -> int | None:
-    low = base_minor + 1
-    high = base_minor + 99
-
-    res = await db._s.execute(
-        select(Subscription.expected_amount_minor).where(
-            Subscription.status == "pending_payment",
-            Subscription.expected_amount_minor.between(low, high),
-        )
-    )
-    used = [row[0] for row in res.all()]
-    used_set = {val for val in used if isinstance(val, int)}
-    for cents in range(1, 100):
-        candidate = base_minor + cents
-        if candidate not in used_set:
-            return candidate
-    return None
+@dataclass(slots=True, frozen=True)
+class _PaymentInfo:
+    amount_minor: int | None
+    plan_title: str
 
 
 def _format_amount(amount_minor: int) -> str:
@@ -75,8 +56,9 @@ async def show_plan_details(
     plan_code: str,
     full_name: str | None = None,
 ) -> None:
-    plan: Plan = await db_call(lambda db: db.plans.getByCode(plan_code))
-    if plan is None or not plan.is_active:
+    # Кнопки строятся из того же снимка, так что план берём из кэша без запроса
+    plan = (await plans.available_plans()).by_code.get(plan_code)
+    if plan is None:
         await helpers.safe_edit(
             query,
             text="Подписка не найдена.",
@@ -90,64 +72,14 @@ async def show_plan_details(
         active_sub = await db.subscriptions.active_for_user(user.id)
 
         if active_sub is not None and active_sub.valid_until is None:
-            return "unlimited", None, plan
+            return "unlimited", None
 
-        res = await db._s.execute(
-            select(Subscription)
-            .where(
-                Subscription.user_id == user.id,
-                Subscription.status == "pending_payment",
-            )
-            .order_by(Subscription.created_at.desc())
-            .limit(1)
-        )
-        existing = res.scalar_one_or_none()
-        if existing is not None and existing.plan_id != plan.id:
-            await db._s.execute(
-                sa_update(Subscription)
-                .where(Subscription.id == existing.id)
-                .values(status="canceled", updated_at=datetime.now(timezone.utc))
-            )
-            await db._s.flush()
-            existing = None
-
-        if existing is not None:
-            plan_for_sub = await db.plans.get(existing.plan_id)
-            return "ok", existing, plan_for_sub
-
-        base_minor = int(plan.price_rub) * 100
-        max_valid_until = await db.subscriptions.max_valid_until_for_user(user.id)
-        now = datetime.now(timezone.utc)
-        start = max(now, max_valid_until) if max_valid_until is not None else now
-
-        valid_until = None
-        if plan.duration_days is not None:
-            valid_until = start + timedelta(days=int(plan.duration_days))
-
-        for _ in range(5):
-            amount_minor = await _find_free_amount(db, base_minor)
-            if amount_minor is None:
-                amount_minor = await _find_free_amount(db, base_minor + 100)
-            if amount_minor is None:
-                return "no_amount", None, plan
-            try:
-                async with db._s.begin_nested():
-                    sub = await db.subscriptions.add(
-                        user_id=user.id,
-                        plan_id=plan.id,
-                        valid_from=start,
-                        valid_until=valid_until,
-                        expected_amount_minor=amount_minor,
-                        status="pending_payment",
-                    )
-                return "ok", sub, plan
-            except IntegrityError:
-                continue
-
-        return "no_amount", None, plan
-
-    result, sub, plan_for_sub = await db_call(work)
-    plan_for_sub = plan_for_sub or plan
+        sub = await db.subscriptions.create_or_reuse_pending(user_id=user.id, plan=plan)
+        if sub is None:
+            return "no_amount", None
+        return "ok", sub
+
+    result, sub = await db_call(work)
 
     if result == "unlimited":
         await helpers.safe_edit(
@@ -169,7 +101,7 @@ async def show_plan_details(
 
     amount_str = _format_amount(sub.expected_amount_minor)
     text = (
-        f"<b>{plan_for_sub.title}</b>\n\n"
+        f"<b>{plan.title}</b>\n\n"
         f"Сумма к оплате: <b>{amount_str} ₽</b>\n"
         f"Переведите по СБП на номер: <b>{settings.SBP_PHONE} ровно эту сумму</b> на <b>Альфа банк</b>\n\n"
         "После оплаты нажмите кнопку ниже."
@@ -195,25 +127,28 @@ async def notify_payment_sent(
     except ValueError:
         sub_id = None
 
-    async def load(db):
+    async def load(db) -> _PaymentInfo | None:
         if sub_id is None:
-            return None, None
-        current_user = await db.users.byTgId(query.from_user.id)
-        if current_user is None:
-            return None, None
+            return None
+        # одна выборка простых значений; проверка владельца — в том же запросе
         res = await db._s.execute(
-            select(Subscription, Plan).join(Plan, Plan.id == Subscription.plan_id).where(
-                Subscription.id == sub_id
+            select(Subscription.expected_amount_minor, Plan.title)
+            .join(Plan, Plan.id == Subscription.plan_id)
+            .join(User, User.id == Subscription.user_id)
+            .where(
+                Subscription.id == sub_id,
+                User.tg_user_id == query.from_user.id,
             )
         )
-        row = res.first()
-        return row, current_user
+        row = res.mappings().first()
+        if row is None:
+            return None
+        return _PaymentInfo(amount_minor=row["expected_amount_minor"], plan_title=row["title"])
 
-    row, current_user = await db_call(load)
-    plan = row[1] if row else None
-    sub = row[0] if row else None
+    # сессия закрыта до любых запросов к Telegram; дальше — только обычные значения
+    info = await db_call(load)
 
-    if sub is None or current_user is None or sub.user_id != current_user.id:
+    if info is None:
         await helpers.safe_edit(
             query,
             text="Подписка не найдена.",
@@ -224,8 +159,8 @@ async def notify_payment_sent(
 
     user = query.from_user
     username = f"@{user.username}" if user and user.username else "без username"
-    amount = _format_amount(sub.expected_amount_minor) if sub and sub.expected_amount_minor else "неизвестно"
-    plan_title = plan.title if plan else "неизвестный план"
+    amount = _format_amount(info.amount_minor) if info.amount_minor else "неизвестно"
+    plan_title = info.plan_title or "неизвестный план"
 
     text = (
         "Пользователь нажал «Я оплатил(а)»:\n"
@@ -235,8 +170,14 @@ async def notify_payment_sent(
         f"amount: {amount} ₽\n"
         f"subscription_id: {subscription_id}"
     )
-    for admin_id in settings.ADMIN_TG_ID:
-        await context.bot.send_message(chat_id=admin_id, text=text)
+    admin_ids = list(settings.ADMIN_TG_ID)
+    results = await asyncio.gather(
+        *(context.bot.send_message(chat_id=admin_id, text=text) for admin_id in admin_ids),
+        return_exceptions=True,
+    )
+    for admin_id, r in zip(admin_ids, results):
+        if isinstance(r, Exception):
+            Logger.warning("Failed to notify admin %s about payment: %s", admin_id, r)
 
     await helpers.safe_edit(
         query,
@@ -1,3 +1,5 @@
+import asyncio
+import functools
 import re
 
 from telegram import (
@@ -16,15 +18,7 @@ USER_REPLY_CALLBACK = "fb_user_reply"
 PROMPT_PREFIX = "[fb]"
 LOG_PREFIX = "[fb]"
 
-USER_TAG_RE = re.compile(r"\[#u(\d+)\]")
-USER_HEADER_RE = re.compile(r"\[#u(\d+)\](?:\s+@([A-Za-z0-9_]{1,32}))?")
-
-
-def _get_admin_ids() -> list[int]:
-    admin_ids = settings.ADMIN_TG_ID
-    if isinstance(admin_ids, list):
-        return [int(admin_id) for admin_id in admin_ids]
-    return [int(admin_ids)]
+USER_HEADER_RE = re.compile(r"\[#u(\d+)\](?:\s+@([A-Za-z0-9_]{1,32}))?", re.ASCII)
 
 
 def _user_header(user_id: int, username: str | None) -> str:
@@ -32,6 +26,13 @@ def _user_header(user_id: int, username: str | None) -> str:
     return f"[#u{user_id}]{name}"
 
 
+# Клавиатуры неизменяемы, поэтому строим их один раз и переиспользуем
+_USER_REPLY_KB = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("💬 Ответить", callback_data=USER_REPLY_CALLBACK)]]
+)
+
+
+@functools.lru_cache(maxsize=4096)
 def _admin_reply_keyboard(user_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [[InlineKeyboardButton("💬 Ответить", callback_data=f"{ADMIN_REPLY_CALLBACK_PREFIX}{user_id}")]]
@@ -39,30 +40,26 @@ def _admin_reply_keyboard(user_id: int) -> InlineKeyboardMarkup:
 
 
 def _user_reply_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("💬 Ответить", callback_data=USER_REPLY_CALLBACK)]]
-    )
+    return _USER_REPLY_KB
+
+
+def _text_or_caption(message) -> str:
+    return message.text or message.caption or ""
 
 
 def _media_caption(header: str | None, caption: str | None) -> str | None:
-    if header and caption:
-        return f"{header}\n\n{caption}"
-    if header:
-        return header
-    return caption
-
-
-def _is_media_message(message) -> bool:
-    return any(
-        [
-            message.photo,
-            message.document,
-            message.video,
-            message.audio,
-            message.voice,
-            message.animation,
-        ]
-    )
+    return "\n\n".join(part for part in (header, caption) if part) or None
+
+
+# (атрибут сообщения = имя аргумента, метод бота, извлечение file_id)
+_MEDIA_SENDERS = (
+    ("photo", "send_photo", lambda m: m.photo[-1].file_id),
+    ("document", "send_document", lambda m: m.document.file_id),
+    ("video", "send_video", lambda m: m.video.file_id),
+    ("audio", "send_audio", lambda m: m.audio.file_id),
+    ("voice", "send_voice", lambda m: m.voice.file_id),
+    ("animation", "send_animation", lambda m: m.animation.file_id),
+)
 
 
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -70,28 +67,25 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     if query is None or query.from_user is None:
         return
 
-    data = (query.data or "").strip()
+    data = query.data or ""
     if not data.startswith("fb_"):
         return
 
     await query.answer()
 
-    admin_ids = _get_admin_ids()
-
     if data.startswith(ADMIN_REPLY_CALLBACK_PREFIX):
-        if query.from_user.id not in admin_ids:
+        if query.from_user.id not in settings.ADMIN_TG_ID:
             return
 
-        user_id_str = data[len(ADMIN_REPLY_CALLBACK_PREFIX):]
+        user_id_str = data.removeprefix(ADMIN_REPLY_CALLBACK_PREFIX)
         if not user_id_str.isdigit():
             return
 
         user_id = int(user_id_str)
         username = None
-        source_text = ""
-        if query.message:
-            source_text = query.message.text or query.message.caption or ""
-        header_match = USER_HEADER_RE.search(source_text)
+        source_text = _text_or_caption(query.message) if query.message else ""
+        # Кнопка "Ответить" есть только у пересланных сообщений, они начинаются с _user_header
+        header_match = USER_HEADER_RE.match(source_text)
         if header_match:
             username = header_match.group(2)
         username_part = f" @{username}" if username else ""
@@ -117,6 +111,22 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         )
 
 
+# (вид для логов, метод бота, аргументы без chat_id/reply_markup)
+def _outgoing(message, header: str | None) -> tuple[str, str, dict] | None:
+    if message.text:
+        text = f"{header}\n\n{message.text}" if header else message.text
+        return "text", "send_message", {"text": text}
+
+    for kind, send_name, get_file_id in _MEDIA_SENDERS:
+        if getattr(message, kind):
+            caption = _media_caption(header, message.caption)
+            return kind, send_name, {kind: get_file_id(message), "caption": caption}
+
+    if header:
+        return "header", "send_message", {"text": header}
+    return None
+
+
 async def _send_with_optional_media(
     context: ContextTypes.DEFAULT_TYPE,
     message,
@@ -124,106 +134,20 @@ async def _send_with_optional_media(
     header: str | None,
     reply_markup: InlineKeyboardMarkup | None,
 ) -> None:
-    if message.text:
-        text = f"{header}\n\n{message.text}" if header else message.text
-        try:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=text,
-                reply_markup=reply_markup,
-            )
-            Logger.info("%s sent text to chat_id=%s", LOG_PREFIX, chat_id)
-        except Exception:
-            Logger.exception("%s failed to send text to chat_id=%s", LOG_PREFIX, chat_id)
+    outgoing = _outgoing(message, header)
+    if outgoing is None:
         return
 
-    if _is_media_message(message):
-        caption = _media_caption(header, message.caption)
-        if message.photo:
-            photo = message.photo[-1].file_id
-            try:
-                await context.bot.send_photo(
-                    chat_id=chat_id,
-                    photo=photo,
-                    caption=caption,
-                    reply_markup=reply_markup,
-                )
-                Logger.info("%s sent photo to chat_id=%s", LOG_PREFIX, chat_id)
-            except Exception:
-                Logger.exception("%s failed to send photo to chat_id=%s", LOG_PREFIX, chat_id)
-            return
-        if message.document:
-            try:
-                await context.bot.send_document(
-                    chat_id=chat_id,
-                    document=message.document.file_id,
-                    caption=caption,
-                    reply_markup=reply_markup,
-                )
-                Logger.info("%s sent document to chat_id=%s", LOG_PREFIX, chat_id)
-            except Exception:
-                Logger.exception("%s failed to send document to chat_id=%s", LOG_PREFIX, chat_id)
-            return
-        if message.video:
-            try:
-                await context.bot.send_video(
-                    chat_id=chat_id,
-                    video=message.video.file_id,
-                    caption=caption,
-                    reply_markup=reply_markup,
-                )
-                Logger.info("%s sent video to chat_id=%s", LOG_PREFIX, chat_id)
-            except Exception:
-                Logger.exception("%s failed to send video to chat_id=%s", LOG_PREFIX, chat_id)
-            return
-        if message.audio:
-            try:
-                await context.bot.send_audio(
-                    chat_id=chat_id,
-                    audio=message.audio.file_id,
-                    caption=caption,
-                    reply_markup=reply_markup,
-                )
-                Logger.info("%s sent audio to chat_id=%s", LOG_PREFIX, chat_id)
-            except Exception:
-                Logger.exception("%s failed to send audio to chat_id=%s", LOG_PREFIX, chat_id)
-            return
-        if message.voice:
-            try:
-                await context.bot.send_voice(
-                    chat_id=chat_id,
-                    voice=message.voice.file_id,
-                    caption=caption,
-                    reply_markup=reply_markup,
-                )
-                Logger.info("%s sent voice to chat_id=%s", LOG_PREFIX, chat_id)
-            except Exception:
-                Logger.exception("%s failed to send voice to chat_id=%s", LOG_PREFIX, chat_id)
-            return
-        if message.animation:
-            try:
-                await context.bot.send_animation(
-                    chat_id=chat_id,
-                    animation=message.animation.file_id,
-                    caption=caption,
-                    reply_markup=reply_markup,
-                )
-                Logger.info("%s sent animation to chat_id=%s", LOG_PREFIX, chat_id)
-            except Exception:
-                Logger.exception("%s failed to send animation to chat_id=%s", LOG_PREFIX, chat_id)
-            return
-        return
-
-    if header:
-        try:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=header,
-                reply_markup=reply_markup,
-            )
-            Logger.info("%s sent header to chat_id=%s", LOG_PREFIX, chat_id)
-        except Exception:
-            Logger.exception("%s failed to send header to chat_id=%s", LOG_PREFIX, chat_id)
+    kind, send_name, kwargs = outgoing
+    try:
+        await getattr(context.bot, send_name)(
+            chat_id=chat_id,
+            reply_markup=reply_markup,
+            **kwargs,
+        )
+        Logger.info("%s sent %s to chat_id=%s", LOG_PREFIX, kind, chat_id)
+    except Exception:
+        Logger.exception("%s failed to send %s to chat_id=%s", LOG_PREFIX, kind, chat_id)
 
 
 async def _handle_admin_reply(
@@ -238,10 +162,10 @@ async def _handle_admin_reply(
     if not reply_to.from_user.is_bot:
         return
 
-    prompt_text = reply_to.text or reply_to.caption or ""
+    prompt_text = _text_or_caption(reply_to)
     if PROMPT_PREFIX not in prompt_text:
         return
-    match = USER_TAG_RE.search(prompt_text)
+    match = USER_HEADER_RE.search(prompt_text)
     if match is None:
         return
 
@@ -249,20 +173,22 @@ async def _handle_admin_reply(
 
     Logger.info("%s admin_reply admin_id=%s user_id=%s", LOG_PREFIX, admin_id, user_id)
 
-    await _send_with_optional_media(
-        context=context,
-        message=message,
-        chat_id=user_id,
-        header=None,
-        reply_markup=_user_reply_keyboard(),
-    )
-
-    await _send_with_optional_media(
-        context=context,
-        message=message,
-        chat_id=admin_id,
-        header=f"✅ Отправлено пользователю [#u{user_id}]",
-        reply_markup=None,
+    # Ошибки отправки логируются внутри _send_with_optional_media
+    await asyncio.gather(
+        _send_with_optional_media(
+            context=context,
+            message=message,
+            chat_id=user_id,
+            header=None,
+            reply_markup=_user_reply_keyboard(),
+        ),
+        _send_with_optional_media(
+            context=context,
+            message=message,
+            chat_id=admin_id,
+            header=f"✅ Отправлено пользователю [#u{user_id}]",
+            reply_markup=None,
+        ),
     )
 
 
@@ -298,14 +224,15 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if message.from_user.is_bot:
         return
 
-    admin_ids = _get_admin_ids()
-    if not admin_ids:
+    if not settings.ADMIN_TG_ID:
         Logger.error("%s no_admin_ids_configured", LOG_PREFIX)
         return
 
-    if message.from_user.id in admin_ids:
+    if message.from_user.id in settings.ADMIN_TG_ID:
         await _handle_admin_reply(message, context, message.from_user.id)
         return
 
-    for admin_id in admin_ids:
-        await _handle_user_message(message, context, admin_id)
+    await asyncio.gather(
+        *(_handle_user_message(message, context, admin_id) for admin_id in settings.ADMIN_TG_ID),
+        return_exceptions=True,
+    )
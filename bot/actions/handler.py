@@ -45,6 +45,76 @@ async def _render_main_menu(query: CallbackQuery, tg_user_id, username: str | No
     )
 
 
+async def _choose_plan(query, context, arg, tg_user_id, username, full_name) -> None:
+    await choose_plan.show_plans(query, context)
+
+
+async def _plan_details(query, context, arg, tg_user_id, username, full_name) -> None:
+    await choose_plan.show_plan_details(query, context, tg_user_id, username, arg, full_name)
+
+
+async def _payment_sent(query, context, arg, tg_user_id, username, full_name) -> None:
+    await choose_plan.notify_payment_sent(query, context, arg)
+
+
+async def _main_menu(query, context, arg, tg_user_id, username, full_name) -> None:
+    await _render_main_menu(query, tg_user_id, username, full_name)
+
+
+async def _other_device(query, context, arg, tg_user_id, username, full_name) -> None:
+    await main_menu.render_other_device(query, tg_user_id, username, full_name)
+
+
+async def _copy_connect_link(query, context, arg, tg_user_id, username, full_name) -> None:
+    link_text, _ = await main_menu.build_other_device_view(tg_user_id, username, full_name)
+    if query.message:
+        await query.message.reply_text(
+            text=link_text,
+            disable_web_page_preview=True,
+        )
+
+
+async def _faq(query, context, arg, tg_user_id, username, full_name) -> None:
+    await main_menu.render_faq(query, tg_user_id, username)
+
+
+async def _admin_broadcast(query, context, arg, tg_user_id, username, full_name) -> None:
+    if tg_user_id not in settings.ADMIN_TG_ID:
+        Logger.error("User \"%s\" tried to get admin rights", username or tg_user_id)
+        return
+
+    context.user_data["awaiting_broadcast"] = True
+
+    await helpers.safe_edit(
+        query,
+        text=(
+            "📣 <b>Рассылка</b>\n\n"
+            "Отправьте текст сообщения, которое нужно разослать.\n"
+            "Или напишите /cancel для отмены."
+        ),
+        reply_markup=return_main_menu.keyboard(),
+        parse_mode=HTML,
+    )
+
+
+# callback_data без аргумента
+_EXACT_ACTIONS = {
+    "choose_plan": _choose_plan,
+    "back_to_main": _main_menu,
+    "connect_other_device": _other_device,
+    "copy_connect_link": _copy_connect_link,
+    "refresh_main_menu": _main_menu,
+    "faq_main_menu": _faq,
+    "admin_broadcast": _admin_broadcast,
+}
+
+# callback_data вида "<префикс>:<аргумент>"
+_PREFIX_ACTIONS = {
+    "plan": _plan_details,
+    "payment_sent": _payment_sent,
+}
+
+
 async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query: CallbackQuery | None = update.callback_query
     if query is None or query.from_user is None:
@@ -52,71 +122,14 @@ async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     await query.answer()
 
-    action = (query.data or "").strip()
+    action = query.data or ""
 
     tg_user_id = query.from_user.id
     username = query.from_user.username
     full_name = " ".join(filter(None, [query.from_user.first_name, query.from_user.last_name])) or None
-    match action:
-        case "choose_plan":
-            await choose_plan.show_plans(query, context)
-            return
-
-        case _ if action.startswith("plan:"):
-            plan_code = action.split(":", 1)[1]
-            await choose_plan.show_plan_details(query, context, tg_user_id, username, plan_code, full_name)
-            return
-
-        case _ if action.startswith("payment_sent:"):
-            sub_id = action.split(":", 1)[1]
-            await choose_plan.notify_payment_sent(query, context, sub_id)
-            return
-
-        case "back_to_main":
-            await _render_main_menu(query, tg_user_id, username, full_name)
-            return
-
-        case "connect_other_device":
-            await main_menu.render_other_device(query, tg_user_id, username, full_name)
-            return
-
-        case "copy_connect_link":
-            link_text, _ = await main_menu.build_other_device_view(tg_user_id, username, full_name)
-            if query.message:
-                await query.message.reply_text(
-                    text=link_text,
-                    disable_web_page_preview=True,
-                )
-            return
-
-        case "refresh_main_menu":
-            await _render_main_menu(query, tg_user_id, username, full_name)
-            return
-
-        case "faq_main_menu":
-            await main_menu.render_faq(query, tg_user_id, username)
-            return
-        
-        case "admin_broadcast":
-            if tg_user_id not in settings.ADMIN_TG_ID:
-                Logger.error("User \"%s\" tried to get admin rights", username or tg_user_id)
-                return
-
-            context.user_data["awaiting_broadcast"] = True
-
-            await helpers.safe_edit(
-                query,
-                text=(
-                    "📣 <b>Рассылка</b>\n\n"
-                    "Отправьте текст сообщения, которое нужно разослать.\n"
-                    "Или напишите /cancel для отмены."
-                ),
-                reply_markup=return_main_menu.keyboard(),
-                parse_mode=HTML,
-            )
-            return
-
-
-        case _:
-            await _render_main_menu(query, tg_user_id, username, full_name)
-            return
+
+    prefix, sep, arg = action.partition(":")
+    fn = _PREFIX_ACTIONS.get(prefix) if sep else _EXACT_ACTIONS.get(action)
+    if fn is None:
+        fn = _main_menu
+    await fn(query, context, arg, tg_user_id, username, full_name)
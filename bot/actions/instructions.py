@@ -4,17 +4,20 @@ ANDROID_URL = "https://play.google.com/store/apps/details?id=dev.hexasoftware.v2
 IOS_URL = "https://apps.apple.com/ru/app/v2box-v2ray-client/id6446814690"
 
 
+INSTRUCTION_HTML = (
+    "📖 <b>Инструкция по подключению</b>\n\n"
+    "1) Установите приложение <b>V2Box</b>:\n"
+    f"• Android: <a href=\"{ANDROID_URL}\">Google Play</a>\n"
+    f"• iOS: <a href=\"{IOS_URL}\">App Store</a>\n"
+    "2) В этом боте нажмите кнопку <b>«Получить бесплатно»</b>.\n"
+    "3) Скопируйте ссылку/конфиг в буфер обмена.\n"
+    "4) Откройте V2Box и перейдите на вкладку <b>«Конфигурации»</b>.\n"
+    "5) Нажмите <b>«+»</b> в правом верхнем углу.\n"
+    "6) Выберите <b>Добавить подписку</b>.\n"
+    "7) Придумайте название (любое) и вставьте ссылку\n"
+    "8) Нажмите <b>Добавить источник</b>"
+)
+
+
 def text() -> str:
-    return (
-        "📖 <b>Инструкция по подключению</b>\n\n"
-        "1) Установите приложение <b>V2Box</b>:\n"
-        f"• Android: <a href=\"{ANDROID_URL}\">Google Play</a>\n"
-        f"• iOS: <a href=\"{IOS_URL}\">App Store</a>\n"
-        "2) В этом боте нажмите кнопку <b>«Получить бесплатно»</b>.\n"
-        "3) Скопируйте ссылку/конфиг в буфер обмена.\n"
-        "4) Откройте V2Box и перейдите на вкладку <b>«Конфигурации»</b>.\n"
-        "5) Нажмите <b>«+»</b> в правом верхнем углу.\n"
-        "6) Выберите <b>Добавить подписку</b>.\n"
-        "7) Придумайте название (любое) и вставьте ссылку\n"
-        "8) Нажмите <b>Добавить источник</b>"
-    )
+    return INSTRUCTION_HTML
@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+import asyncio
+import functools
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from urllib.parse import quote
 
@@ -8,7 +11,7 @@ from telegram.constants import ParseMode
 
 from bot.actions import settings
 from bot.actions.settings import PUBLIC_BASE_URL
-from bot.helpers import helpers
+from bot.helpers import helpers, plans
 from common.db import db_call
 from common.models import Plan, Subscription, User
 from sqlalchemy import select
@@ -16,174 +19,209 @@ from sqlalchemy import select
 HTML = ParseMode.HTML
 
 
-def _make_connect_ref(subscription_token: str) -> str:
-    return f"{PUBLIC_BASE_URL}/connect/{subscription_token}"
+# Неизменяемые строки клавиатур, общие для всех пользователей
+_OTHER_DEVICE_ROW = (InlineKeyboardButton("🤝 Подключить другое устройство", callback_data="connect_other_device"),)
+_COPY_LINK_ROW = (InlineKeyboardButton("📎 Скопировать", callback_data="copy_connect_link"),)
+_BACK_ROW = (InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main"),)
+_FAQ_ROW = (InlineKeyboardButton("💬 Если у вас остались вопросы", callback_data="faq_main_menu"),)
+_REFRESH_ROW = (InlineKeyboardButton("🔁 Обновить", callback_data="refresh_main_menu"),)
+_ADMIN_ROW = (InlineKeyboardButton("📣 Сделать рассылку", callback_data="admin_broadcast"),)
+_USER_TAIL = (_FAQ_ROW, _REFRESH_ROW)
+_ADMIN_TAIL = (_ADMIN_ROW, _FAQ_ROW, _REFRESH_ROW)
 
 
-def _make_share_ref(connect_ref: str) -> str:
-    return f"https://t.me/share/url?url={quote(connect_ref)}"
+_SUSPENDED_TEXT = (
+    "Доступ приостановлен\n\n"
+    "Верните доступ за минуту — выберите тариф"
+)
+_READY_PREFIX = (
+    "VPN готов к работе\n\n"
+    "Доступно до 5 устройств\n\n"
+)
+
+
+def _tail_rows(tg_user_id: int) -> tuple[tuple[InlineKeyboardButton, ...], ...]:
+    return _ADMIN_TAIL if tg_user_id in settings.ADMIN_TG_ID else _USER_TAIL
+
+
+_CONNECT_PREFIX = f"{PUBLIC_BASE_URL}/connect/"
+_SHARE_PREFIX = "https://t.me/share/url?url="
 
 
-async def _get_user(tg_user_id: int, username: str | None, full_name: str | None = None) -> User:
-    return await db_call(lambda db: db.users.getOrCreate(tg_user_id, username, full_name=full_name))
+def _make_connect_ref(subscription_token: str) -> str:
+    return _CONNECT_PREFIX + subscription_token
+
+
+# Токен у пользователя постоянный, поэтому ссылка для пересылки кодируется один раз
+@functools.lru_cache(maxsize=10_000)
+def _make_share_ref(connect_ref: str) -> str:
+    return _SHARE_PREFIX + quote(connect_ref)
 
 
 def _days_left(valid_until: datetime | None) -> str:
     if valid_until is None:
         return "без ограничений"
-    now = datetime.now(timezone.utc)
-    delta = (valid_until - now).total_seconds()
-    days = max(0, int((delta + 86399) // 86400))
-    return f"{days} дн."
-
-
-async def _ensure_trial_subscription(user: User) -> None:
-    async def _load(db) -> None:
-        db_user = await db.users.get(user.id)
-        if db_user is None:
-            return
-        active_sub = await db.subscriptions.active_for_user(user.id)
-        if active_sub is not None:
-            return
-
-        if db_user.used_trial:
-            return
-
-        trial_plan = await db.plans.getByCode("trial")
-        if trial_plan is None or not trial_plan.is_active:
-            return
-
-        now = datetime.now(timezone.utc)
-        valid_until = None
-        if trial_plan.duration_days is not None:
-            valid_until = now + timedelta(days=int(trial_plan.duration_days))
-
-        await db.subscriptions.add(
-            user_id=user.id,
-            plan_id=trial_plan.id,
-            valid_from=now,
-            valid_until=valid_until,
-            expected_amount_minor=0,
-            status="pending_payment",
-        )
-        db_user.used_trial = True
-        await db._s.flush()
+    delta = valid_until - datetime.now(timezone.utc)
+    # Неполный день считается за целый
+    days = delta.days + (delta.seconds > 0)
+    return f"{max(0, days)} дн."
 
-    await db_call(_load)
 
+# Вызывается только когда у пользователя нет активной подписки
+async def _ensure_trial_subscription(db, user: User) -> None:
+    if user.used_trial:
+        return
 
-async def _get_active_subscription(
-    user: User,
-) -> tuple[Subscription | None, Plan | None]:
-    async def _load(db):
-        active_sub = await db.subscriptions.active_for_user(user.id)
-        if active_sub is None:
-            return None, None
-        active_plan = await db.plans.get(active_sub.plan_id)
-        return active_sub, active_plan
-
-    return await db_call(_load)
+    # План из кэша; в снимке только активные планы
+    trial_plan = (await plans.available_plans()).trial
+    if trial_plan is None:
+        return
 
-
-async def _get_max_valid_until(user: User) -> datetime | None:
-    return await db_call(lambda db: db.subscriptions.max_valid_until_for_user(user.id))
+    now = datetime.now(timezone.utc)
+    valid_until = None
+    if trial_plan.duration_days is not None:
+        valid_until = now + timedelta(days=int(trial_plan.duration_days))
+
+    await db.subscriptions.add(
+        user_id=user.id,
+        plan_id=trial_plan.id,
+        valid_from=now,
+        valid_until=valid_until,
+        expected_amount_minor=0,
+        status="pending_payment",
+    )
+    user.used_trial = True
+    await db._s.flush()
 
 
 async def _get_pending_trial_subscription(
+    db,
     user: User,
 ) -> tuple[Subscription | None, Plan | None]:
-    async def _load(db):
-        stmt = (
-            select(Subscription, Plan)
-            .join(Plan, Plan.id == Subscription.plan_id)
-            .where(
-                Subscription.user_id == user.id,
-                Subscription.status == "pending_payment",
-                Plan.code == "trial",
-            )
-            .order_by(Subscription.created_at.desc())
-            .limit(1)
+    stmt = (
+        select(Subscription, Plan)
+        .join(Plan, Plan.id == Subscription.plan_id)
+        .where(
+            Subscription.user_id == user.id,
+            Subscription.status == "pending_payment",
+            Plan.code == "trial",
         )
-        res = await db._s.execute(stmt)
-        row = res.first()
-        if row is None:
-            return None, None
-        sub, plan = row
-        return sub, plan
+        .order_by(Subscription.created_at.desc())
+        .limit(1)
+    )
+    res = await db._s.execute(stmt)
+    row = res.first()
+    if row is None:
+        return None, None
+    sub, plan = row
+    return sub, plan
+
+
+@dataclass(slots=True, frozen=True)
+class _MainState:
+    user: User
+    sub: Subscription | None
+    plan: Plan | None
+    max_valid_until: datetime | None
+
+
+async def _load_main_state(
+    db,
+    tg_user_id: int,
+    username: str | None,
+    full_name: str | None,
+    refer_id: str | None = None,
+) -> _MainState:
+    user = await db.users.getOrCreate(tg_user_id, username, refer_id=refer_id, full_name=full_name)
+    sub, plan = await db.subscriptions.active_with_plan(user.id)
+    if sub is None:
+        await _ensure_trial_subscription(db, user)
+        sub, plan = await _get_pending_trial_subscription(db, user)
+        if sub is None:
+            return _MainState(user, None, None, None)
 
-    return await db_call(_load)
+    max_valid_until = await db.subscriptions.max_valid_until_for_user(user.id)
+    return _MainState(user, sub, plan, max_valid_until)
 
 
-async def _get_available_plans() -> list[Plan]:
-    plans = await db_call(lambda db: db.plans.active())
-    return [p for p in plans if p.code not in {"free", "trial"}]
+# Сборка меню, уже идущая для пользователя (двойной клик, "Обновить" подряд)
+_inflight_views: dict[int, asyncio.Task] = {}
 
 
 async def build_main_view(
     tg_user_id: int,
     username: str | None,
     full_name: str | None = None,
+    refer_id: str | None = None,
 ) -> tuple[str, InlineKeyboardMarkup]:
-    user = await _get_user(tg_user_id, username, full_name)
-    await _ensure_trial_subscription(user)
-    active_sub, active_plan = await _get_active_subscription(user)
-    if active_sub is None:
-        pending_trial, pending_plan = await _get_pending_trial_subscription(user)
-        if pending_trial is not None:
-            active_sub = pending_trial
-            active_plan = pending_plan
-    if active_sub is None:
-        plans = await _get_available_plans()
-        text = (
-            "Доступ приостановлен\n\n"
-            "Верните доступ за минуту — выберите тариф"
-        )
-        rows = [
-            [InlineKeyboardButton(f"{p.title} — {p.price_rub} ₽", callback_data=f"plan:{p.code}")]
-            for p in plans
-        ]
-        if tg_user_id in settings.ADMIN_TG_ID:
-            rows.append([InlineKeyboardButton("📣 Сделать рассылку", callback_data="admin_broadcast")])
-        rows.append([InlineKeyboardButton("💬 Если у вас остались вопросы", callback_data="faq_main_menu")])
-        rows.append([InlineKeyboardButton("🔁 Обновить", callback_data="refresh_main_menu")])
-        return text, InlineKeyboardMarkup(rows)
-
-    plan_title = active_plan.title if active_plan is not None else "неизвестен"
-    max_valid_until = await _get_max_valid_until(user)
-    days_left = _days_left(max_valid_until or active_sub.valid_until)
-    connect_ref = _make_connect_ref(user.subscription_token)
-    text = (
-        "VPN готов к работе\n\n"
-        "Доступно до 5 устройств\n\n"
-        f"Тариф: {plan_title}\n"
-        f"Осталось: {days_left}"
-    )
+    # /start с источником строим отдельно: чужая сборка (refer_id=None) его не сохранит
+    if refer_id is not None:
+        return await _build_main_view(tg_user_id, username, full_name, refer_id)
+
+    task = _inflight_views.get(tg_user_id)
+    if task is None:
+        task = asyncio.create_task(_build_main_view(tg_user_id, username, full_name, refer_id))
+        _inflight_views[tg_user_id] = task
+
+        def _forget(t: asyncio.Task) -> None:
+            if _inflight_views.get(tg_user_id) is t:
+                del _inflight_views[tg_user_id]
+
+        task.add_done_callback(_forget)
+    # shield: отмена одного ожидающего не должна отменять сборку для остальных
+    return await asyncio.shield(task)
+
+
+async def _build_main_view(
+    tg_user_id: int,
+    username: str | None,
+    full_name: str | None,
+    refer_id: str | None,
+) -> tuple[str, InlineKeyboardMarkup]:
+    # Все запросы меню идут в одной сессии, чтобы не брать соединение из пула несколько раз
+    state = await db_call(lambda db: _load_main_state(db, tg_user_id, username, full_name, refer_id))
+    if state.sub is None:
+        rows = (await plans.available_plans()).rows + _tail_rows(tg_user_id)
+        return _SUSPENDED_TEXT, InlineKeyboardMarkup(rows)
+
+    plan_title = state.plan.title if state.plan is not None else "неизвестен"
+    days_left = _days_left(state.max_valid_until or state.sub.valid_until)
+    connect_ref = _make_connect_ref(state.user.subscription_token)
+    text = f"{_READY_PREFIX}Тариф: {plan_title}\nОсталось: {days_left}"
     rows = [
         [InlineKeyboardButton("✨ Подключить", url=connect_ref)],
-        [InlineKeyboardButton("🤝 Подключить другое устройство", callback_data="connect_other_device")],
+        _OTHER_DEVICE_ROW,
+        *_tail_rows(tg_user_id),
     ]
-    if tg_user_id in settings.ADMIN_TG_ID:
-        rows.append([InlineKeyboardButton("📣 Сделать рассылку", callback_data="admin_broadcast")])
-    rows.append([InlineKeyboardButton("💬 Если у вас остались вопросы", callback_data="faq_main_menu")])
-    rows.append([InlineKeyboardButton("🔁 Обновить", callback_data="refresh_main_menu")])
     return text, InlineKeyboardMarkup(rows)
 
 
+async def _load_user_with_trial(
+    db,
+    tg_user_id: int,
+    username: str | None,
+    full_name: str | None,
+) -> User:
+    user = await db.users.getOrCreate(tg_user_id, username, full_name=full_name)
+    if not await db.subscriptions.has_active(user.id):
+        await _ensure_trial_subscription(db, user)
+    return user
+
+
 async def build_other_device_view(
     tg_user_id: int,
     username: str | None,
     full_name: str | None = None,
 ) -> tuple[str, InlineKeyboardMarkup]:
-    user = await _get_user(tg_user_id, username, full_name)
-    await _ensure_trial_subscription(user)
+    user = await db_call(lambda db: _load_user_with_trial(db, tg_user_id, username, full_name))
     connect_ref = _make_connect_ref(user.subscription_token)
     share_ref = _make_share_ref(connect_ref)
     text = connect_ref
     rows = [
-        [InlineKeyboardButton("📎 Скопировать", callback_data="copy_connect_link")],
+        _COPY_LINK_ROW,
         [InlineKeyboardButton("🌐 Открыть", url=connect_ref)],
         [InlineKeyboardButton("✉️ Переслать", url=share_ref)],
-        [InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main")],
+        _BACK_ROW,
     ]
     return text, InlineKeyboardMarkup(rows)
 
@@ -204,21 +242,23 @@ async def render_other_device(
     )
 
 
+_FAQ_TEXT = (
+    "Если у вас остались вопросы\n\n"
+    "VPN работает автоматически\n"
+    "Ничего настраивать не нужно\n\n"
+    "Если что-то не произошло сразу — просто нажмите ещё раз\n"
+    "Иногда система может спросить подтверждение — это нормально\n\n"
+    "Одна и та же ссылка работает на нескольких устройствах\n"
+    "Иногда требуется немного времени"
+)
+_FAQ_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💬 Сообщить о проблеме", callback_data="fb_user_reply")],
+    _BACK_ROW,
+])
+
+
 async def build_faq_view() -> tuple[str, InlineKeyboardMarkup]:
-    text = (
-        "Если у вас остались вопросы\n\n"
-        "VPN работает автоматически\n"
-        "Ничего настраивать не нужно\n\n"
-        "Если что-то не произошло сразу — просто нажмите ещё раз\n"
-        "Иногда система может спросить подтверждение — это нормально\n\n"
-        "Одна и та же ссылка работает на нескольких устройствах\n"
-        "Иногда требуется немного времени"
-    )
-    rows = [
-        [InlineKeyboardButton("💬 Сообщить о проблеме", callback_data="fb_user_reply")],
-        [InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main")],
-    ]
-    return text, InlineKeyboardMarkup(rows)
+    return _FAQ_TEXT, _FAQ_KEYBOARD
 
 
 async def render_faq(
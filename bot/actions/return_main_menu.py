@@ -1,7 +1,9 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main")]
+])
+
 
 def keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main")]
-    ])
\ No newline at end of file
+    return _KEYBOARD
@@ -8,8 +8,8 @@ TG_BOT_TOKEN = os.environ.get("TG_BOT_TOKEN", "").strip()
 _admin_raw = os.environ.get("ADMIN_TG_ID", "").strip() or os.environ.get("ADMIN_TG_IDS", "").strip()
 if _admin_raw:
     parts = [p for p in _admin_raw.replace(";", ",").split(",") if p.strip()]
-    ADMIN_TG_ID = [int(p.strip()) for p in parts]
+    ADMIN_TG_ID: frozenset[int] = frozenset(int(p.strip()) for p in parts)
 else:
-    ADMIN_TG_ID = [572200030]
+    ADMIN_TG_ID = frozenset({572200030})
 if not TG_BOT_TOKEN:
     raise RuntimeError("TG_BOT_TOKEN is empty. Export TG_BOT_TOKEN env var.")
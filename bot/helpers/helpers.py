@@ -7,11 +7,9 @@ from telegram.constants import ParseMode
 from telegram.error import BadRequest
 
 
-_NOT_MODIFIED_PATTERNS = (
-    "Message is not modified",
-    "message is not modified",
-    "MESSAGE_NOT_MODIFIED",
-)
+# Сравниваются с текстом ошибки в нижнем регистре
+_NOT_MODIFIED = "message is not modified"
+_NOT_MODIFIED_CODE = "message_not_modified"
 
 
 async def safe_edit(
@@ -41,7 +39,7 @@ async def safe_edit(
         else:
             await q.edit_message_reply_markup(reply_markup=reply_markup)
     except BadRequest as e:
-        msg = str(e)
-        if any(p in msg for p in _NOT_MODIFIED_PATTERNS):
+        msg = e.message.lower()
+        if _NOT_MODIFIED in msg or _NOT_MODIFIED_CODE in msg:
             return
         raise
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from common.db import db_call
+from common.models import Plan
+
+# Планы меняются редко (только из админки, в другом процессе), поэтому
+# список и готовые кнопки держатся в памяти TTL секунд.
+TTL = 30.0
+
+
+@dataclass(slots=True, frozen=True)
+class PlansSnapshot:
+    plans: list[Plan]
+    by_code: dict[str, Plan]
+    # активный пробный план, если есть (в plans/by_code не входит)
+    trial: Plan | None
+    # по строке с кнопкой на каждый план
+    rows: tuple[tuple[InlineKeyboardButton, ...], ...]
+    # экран выбора тарифа: планы + "Назад"
+    choose_markup: InlineKeyboardMarkup
+
+
+_snapshot: tuple[float, PlansSnapshot] | None = None
+_lock = asyncio.Lock()
+
+
+def _build(plans: list[Plan]) -> PlansSnapshot:
+    trial = next((p for p in plans if p.code == "trial"), None)
+    plans = [p for p in plans if p.code != "free" and p.code != "trial"]
+    rows = tuple(
+        (InlineKeyboardButton(f"{p.title} — {p.price_rub} ₽", callback_data=f"plan:{p.code}"),)
+        for p in plans
+    )
+    back = (InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main"),)
+    by_code = {p.code: p for p in plans}
+    return PlansSnapshot(plans, by_code, trial, rows, InlineKeyboardMarkup(rows + (back,)))
+
+
+async def available_plans() -> PlansSnapshot:
+    """Активные платные планы (без free/trial) и пробный план из кэша."""
+    global _snapshot
+    cached = _snapshot
+    if cached is not None and time.monotonic() - cached[0] < TTL:
+        return cached[1]
+
+    # Один запрос на всех, кто пришёл за просроченным кэшем
+    async with _lock:
+        cached = _snapshot
+        if cached is not None and time.monotonic() - cached[0] < TTL:
+            return cached[1]
+        snapshot = _build(await db_call(lambda db: db.plans.active()))
+        _snapshot = (time.monotonic(), snapshot)
+        return snapshot
@@ -9,6 +9,7 @@ from telegram import (
     Update,
 )
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CallbackQueryHandler,
     CommandHandler,
@@ -17,15 +18,16 @@ from telegram.ext import (
     filters
 )
 
-from common.db import db_call, init_db_engine
+from common.db import close_engine, init_db_engine, make_dsn
+from common.listener import NotifyPump
 from bot.reports import daily_report_task
 from bot.subscription_tasks import (
     overdue_notification_task,
     expiry_reminder_task,
     expired_notification_task,
+    on_subscription_notification,
 )
 from common.logger import Logger, Level
-from common.models import User
 from common.xui_client.registry import Manager
 from bot.actions.handler import handler
 from bot.actions import main_menu
@@ -42,10 +44,10 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     full_name = " ".join(filter(None, [tg_user.first_name, tg_user.last_name])) or None
-    user: User = await db_call(lambda db: db.users.getOrCreate(tg_user.id, tg_user.username, refer_id=source, full_name=full_name))
     Logger.info("User start: tg_user_id=%s username=%s, source=\"%s\"", tg_user.id, tg_user.username, source or "")
-    
-    text, reply_markup = await main_menu.build_main_view(tg_user_id, tg_user.username)
+
+    # Пользователь создаётся (с refer_id) в той же сессии, что собирает меню
+    text, reply_markup = await main_menu.build_main_view(tg_user_id, tg_user.username, full_name, refer_id=source)
     await update.message.reply_text(
         text=text,
         reply_markup=reply_markup,
@@ -59,11 +61,42 @@ async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     Logger.exception("Unhandled error: %s", context.error)
 
 
+async def subscriptions_listener_task() -> None:
+    pump = NotifyPump(
+        make_dsn(
+            os.environ["VPN_BOT_DB_USERNAME"],
+            os.environ["VPN_BOT_DB_PASSWORD"],
+        ),
+        ["subscriptions_changed"],
+        retry_delay=5,
+    )
+
+    async def _wake() -> None:
+        while True:
+            for n in await pump.get_batch(pump.queue.maxsize):
+                on_subscription_notification(n.payload)
+
+    await asyncio.gather(pump.run(), _wake())
+
+
 def build_app() -> Application:
     Logger.configure("bot", level=Level.DEBUG)
     Logger.silence("telegram", "telegram.ext", "httpx", "httpcore.http11", "httpcore.connection", level=Level.WARNING)
 
-    app = Application.builder().token(TG_BOT_TOKEN).build()
+    # Ответы на кнопки и уведомления уходят пачками: пул с запасом, HTTP/2 для
+    # мультиплексирования, и ожидание свободного соединения дольше дефолтной 1 с.
+    # getUpdates остаётся на своём отдельном HTTP/1.1 соединении.
+    app = (
+        Application.builder()
+        .token(TG_BOT_TOKEN)
+        .connection_pool_size(256)
+        .pool_timeout(30.0)
+        .connect_timeout(10.0)
+        .read_timeout(30.0)
+        .http_version("2")
+        .rate_limiter(AIORateLimiter())
+        .build()
+    )
     app.bot_data["servers_manager"] = Manager()
 
     async def _post_init(application: Application) -> None:
@@ -74,8 +107,13 @@ def build_app() -> Application:
         asyncio.create_task(overdue_notification_task(application))
         asyncio.create_task(expiry_reminder_task(application))
         asyncio.create_task(expired_notification_task(application))
+        asyncio.create_task(subscriptions_listener_task())
+
+    async def _post_shutdown(application: Application) -> None:
+        await close_engine()
 
     app.post_init = _post_init
+    app.post_shutdown = _post_shutdown
 
     app.add_error_handler(on_error)
     app.add_handler(CommandHandler("start", cmd_start))
@@ -88,7 +126,16 @@ def build_app() -> Application:
     return app
 
 
+def _install_uvloop() -> None:
+    try:
+        import uvloop
+    except ImportError:
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
 def main() -> None:
+    _install_uvloop()
     init_db_engine(
         os.environ["VPN_BOT_DB_USERNAME"],
         os.environ["VPN_BOT_DB_PASSWORD"],
@@ -1,4 +1,5 @@
 import asyncio
+import time
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
@@ -10,6 +11,35 @@ from common.logger import Logger
 
 TZ = ZoneInfo("Europe/Moscow")
 
+_REPORT_HEADER = "Новые пользователи за последние 24 часа:"
+# Лимит Telegram на длину текста сообщения
+_MESSAGE_LIMIT = 4096
+
+
+def _display_name(u) -> str:
+    uname = u.username
+    if not uname:
+        return f"(no_username:{u.tg_user_id})"
+    return uname if uname[0] == "@" else "@" + uname
+
+
+def _split_message(header: str, lines) -> list[str]:
+    """Склеивает строки под заголовком, разбивая на сообщения не длиннее лимита."""
+    parts: list[str] = []
+    chunk = [header]
+    size = len(header)
+    for line in lines:
+        if size + 1 + len(line) > _MESSAGE_LIMIT:
+            parts.append("\n".join(chunk))
+            chunk = []
+            size = -1
+        chunk.append(line)
+        size += 1 + len(line)
+    if len(chunk) == 1 and not parts:
+        chunk.append("(нет)")
+    parts.append("\n".join(chunk))
+    return parts
+
 async def daily_report_task(app: Application, adminTgId) -> None:
     while True:
         now = datetime.now(TZ)
@@ -19,7 +49,11 @@ async def daily_report_task(app: Application, adminTgId) -> None:
         if now >= target:
             target += timedelta(days=1)
 
-        await asyncio.sleep((target - now).total_seconds())
+        # Ждём по абсолютному времени: разница aware-дат в одной зоне считается
+        # по настенным часам, а sleep может проснуться раньше при сдвиге часов.
+        deadline = target.timestamp()
+        while (left := deadline - time.time()) > 0:
+            await asyncio.sleep(max(1.0, left))
 
         try:
             async def work(db: DbAdapters):
@@ -29,21 +63,14 @@ async def daily_report_task(app: Application, adminTgId) -> None:
 
             users = await db_call(work)
 
-            names: list[str] = []
-            for u in users:
-                if getattr(u, "username", None):
-                    uname = u.username
-                    names.append(f"@{uname}" if not uname.startswith("@") else uname)
-                else:
-                    names.append(f"(no_username:{u.tg_user_id})")
-
-            text = "Новые пользователи за последние 24 часа:\n" + ("\n".join(names) if names else "(нет)")
-            for admin_id in adminTgId:
-                await app.bot.send_message(
-                    chat_id=admin_id,
-                    text=text,
-                    disable_web_page_preview=True,
-                )
+            names = (_display_name(u) for u in users)
+            for text in _split_message(_REPORT_HEADER, names):
+                for admin_id in adminTgId:
+                    await app.bot.send_message(
+                        chat_id=admin_id,
+                        text=text,
+                        disable_web_page_preview=True,
+                    )
         except Exception:
             Logger.exception("daily_report_task failed")
             await asyncio.sleep(5)
@@ -1,70 +1,218 @@
 from __future__ import annotations
 
 import asyncio
+import json
+import uuid
 from datetime import datetime, timedelta, timezone
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.error import Forbidden
 from telegram.ext import Application
-from sqlalchemy import select, update as sa_update
+from sqlalchemy import func, select, update as sa_update
 
 from common.db import db_call
 from common.logger import Logger
 from common.models import Plan, Subscription, User
 
+# Сколько уведомлений отправляется одновременно; общий темп ограничивает
+# AIORateLimiter приложения.
+SEND_CONCURRENCY = 25
+CLAIM_LIMIT = 100
+
+_RENEW_KB = InlineKeyboardMarkup([[InlineKeyboardButton("Продлить", callback_data="choose_plan")]])
+_OVERDUE_TEXT = (
+    "Время на оплату истекло.\n\n"
+    "Нажмите «Продлить», чтобы начать оплату заново."
+)
+_REMINDER_TEMPLATE = (
+    "Подписка «{}» скоро закончится.\n"
+    "До окончания осталось около 3 дней.\n\n"
+    "Продлить сейчас?"
+)
+_EXPIRED_TEMPLATE = (
+    "Подписка «{}» закончилась.\n\n"
+    "Чтобы восстановить доступ, продлите подписку."
+)
+
+# Статусы payment_overdue/expired выставляет pay_verifier, и каждое изменение
+# подписки приходит NOTIFY subscriptions_changed (слушатель в bot/main.py).
+# Таймаут ожидания — страховка на случай потери соединения LISTEN (прежний период опроса).
+OVERDUE_FALLBACK_SECONDS = 30
+EXPIRED_FALLBACK_SECONDS = 60
+# Пауза перед повтором неудавшихся отправок (снятая отметка вернёт их в выборку)
+RETRY_BACKOFF_SECONDS = 60
+# Пауза после ошибки цикла (например, БД недоступна)
+ERROR_BACKOFF_SECONDS = 5
+_overdue_wakeup = asyncio.Event()
+_expired_wakeup = asyncio.Event()
+_WAKEUP_BY_STATUS = {
+    "payment_overdue": _overdue_wakeup,
+    "expired": _expired_wakeup,
+}
+
+
+def on_subscription_notification(payload: str | None) -> None:
+    """
+    Будит уведомитель, только если подписка перешла в его статус.
+    Прочие изменения (новые pending, отметки самих уведомителей) не будят.
+    """
+    try:
+        data = json.loads(payload or "")
+    except ValueError:
+        return
+    if not isinstance(data, dict):
+        return
+    status = data.get("status")
+    if status == data.get("old_status"):
+        return
+    event = _WAKEUP_BY_STATUS.get(status)
+    if event is not None:
+        event.set()
+
+
+async def _wait_wakeup(
+    event: asyncio.Event,
+    timeout: float,
+    *,
+    failed: bool = False,
+    errored: bool = False,
+    full: bool = False,
+) -> None:
+    # Следующий цикл без ожидания NOTIFY; пришедшие за паузу пробуждения покрывает он же
+    if failed or errored:
+        await asyncio.sleep(RETRY_BACKOFF_SECONDS if failed else ERROR_BACKOFF_SECONDS)
+        event.clear()
+        return
+    if full:
+        # Пачка была полной: NOTIFY по оставшимся строкам уже израсходованы, добираем сразу
+        event.clear()
+        return
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except TimeoutError:
+        pass
+    # Сбрасываем до обработки: изменения во время неё разбудят следующий цикл
+    event.clear()
+
+
+async def _claim(*conditions, order_by, values: dict, limit: int | None = CLAIM_LIMIT) -> tuple[list, bool]:
+    """
+    Одним UPDATE ... RETURNING помечает подходящие подписки как уведомлённые
+    и возвращает данные для сообщения. Строки, занятые другим экземпляром бота,
+    пропускаются (SKIP LOCKED), поэтому одно уведомление не уходит дважды.
+    Второе значение — пачка заполнена до limit, то есть подходящие строки могли остаться.
+    """
+    picked = (
+        select(Subscription.id)
+        .where(*conditions)
+        .order_by(*order_by)
+        .with_for_update(skip_locked=True)
+    )
+    if limit is not None:
+        picked = picked.limit(limit)
+
+    stmt = (
+        sa_update(Subscription)
+        .where(
+            Subscription.id.in_(picked),
+            User.id == Subscription.user_id,
+            Plan.id == Subscription.plan_id,
+        )
+        .values(**values)
+        .returning(
+            Subscription.id,
+            Subscription.valid_until,
+            User.tg_user_id,
+            User.username,
+            User.full_name,
+            Plan.title.label("plan_title"),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    async def work(db):
+        res = await db._s.execute(stmt)
+        return list(res.all())
+
+    rows = await db_call(work)
+    return rows, limit is not None and len(rows) == limit
+
+
+async def _release(sub_ids: list[uuid.UUID], **values) -> None:
+    """Снимает отметку с подписок, уведомить которые не удалось, — их возьмёт следующий цикл."""
+    if not sub_ids:
+        return
+
+    async def work(db):
+        await db._s.execute(
+            sa_update(Subscription)
+            .where(Subscription.id.in_(sub_ids))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+
+    await db_call(work)
+
+
+async def _run_concurrently(fn, rows) -> list[uuid.UUID]:
+    """Вызывает fn(row) для всех строк; возвращает id строк, которые нужно повторить."""
+    sem = asyncio.Semaphore(SEND_CONCURRENCY)
+
+    async def guarded(row) -> bool:
+        async with sem:
+            return await fn(row)
+
+    results = await asyncio.gather(*(guarded(row) for row in rows), return_exceptions=True)
+    failed = []
+    for row, r in zip(rows, results):
+        if isinstance(r, Exception):
+            Logger.error("Notification failed: sub_id=%s: %r", row.id, r)
+            failed.append(row.id)
+        elif not r:
+            failed.append(row.id)
+    return failed
+
+
+def _display(row) -> str:
+    return row.full_name or row.username or str(row.tg_user_id)
+
 
 async def overdue_notification_task(app: Application) -> None:
     while True:
+        failed: list[uuid.UUID] = []
+        full = errored = False
         try:
-            async def work(db):
-                stmt = (
-                    select(Subscription, User)
-                    .join(User, User.id == Subscription.user_id)
-                    .where(
-                        Subscription.status == "payment_overdue",
-                        Subscription.notified_overdue.is_(False),
-                    )
-                    .order_by(Subscription.created_at.asc())
-                    .limit(100)
-                )
-                res = await db._s.execute(stmt)
-                return list(res.all())
-
-            rows = await db_call(work)
-            for sub, user in rows:
-                display = user.full_name or user.username or str(user.tg_user_id)
-                Logger.info("Overdue notification: sending to user %s (sub_id=%s)", display, sub.id)
+            rows, full = await _claim(
+                Subscription.status == "payment_overdue",
+                Subscription.notified_overdue.is_(False),
+                order_by=(Subscription.created_at.asc(),),
+                values={"notified_overdue": True},
+            )
+
+            async def notify(row) -> bool:
+                display = _display(row)
+                Logger.info("Overdue notification: sending to user %s (sub_id=%s)", display, row.id)
                 try:
                     await app.bot.send_message(
-                        chat_id=user.tg_user_id,
-                        text=(
-                            "Время на оплату истекло.\n\n"
-                            "Нажмите «Продлить», чтобы начать оплату заново."
-                        ),
-                        reply_markup=InlineKeyboardMarkup(
-                            [[InlineKeyboardButton("Продлить", callback_data="choose_plan")]]
-                        ),
+                        chat_id=row.tg_user_id,
+                        text=_OVERDUE_TEXT,
+                        reply_markup=_RENEW_KB,
                     )
                     Logger.info("Overdue notification: sent to user %s", display)
                 except Forbidden:
                     Logger.warning("Overdue notification: user %s blocked the bot, marking as notified", display)
                 except Exception:
-                    Logger.exception("Failed to notify overdue subscription: sub_id=%s", sub.id)
-                    continue
-
-                async def mark_notified(db):
-                    await db._s.execute(
-                        sa_update(Subscription)
-                        .where(Subscription.id == sub.id)
-                        .values(notified_overdue=True)
-                    )
-                    await db._s.flush()
+                    Logger.exception("Failed to notify overdue subscription: sub_id=%s", row.id)
+                    return False
+                return True
 
-                await db_call(mark_notified)
+            failed = await _run_concurrently(notify, rows)
+            await _release(failed, notified_overdue=False)
         except Exception:
             Logger.exception("overdue_notification_task failed")
+            errored = True
 
-        await asyncio.sleep(30)
+        await _wait_wakeup(_overdue_wakeup, OVERDUE_FALLBACK_SECONDS, failed=bool(failed), errored=errored, full=full)
 
 
 async def expiry_reminder_task(app: Application) -> None:
@@ -74,55 +222,36 @@ async def expiry_reminder_task(app: Application) -> None:
             start = now + timedelta(days=3)
             end = start + timedelta(hours=1)
 
-            async def work(db):
-                stmt = (
-                    select(Subscription, User, Plan)
-                    .join(User, User.id == Subscription.user_id)
-                    .join(Plan, Plan.id == Subscription.plan_id)
-                    .where(
-                        Subscription.status == "active",
-                        Subscription.valid_until.isnot(None),
-                        Subscription.valid_until >= start,
-                        Subscription.valid_until < end,
-                        Subscription.reminded_at.is_(None),
-                    )
-                    .order_by(Subscription.valid_until.asc())
-                )
-                res = await db._s.execute(stmt)
-                return list(res.all())
-
-            rows = await db_call(work)
-            for sub, user, plan in rows:
-                display = user.full_name or user.username or str(user.tg_user_id)
-                Logger.info("Expiry reminder: sending to user %s, plan=%s, valid_until=%s", display, plan.title, sub.valid_until)
+            rows, _ = await _claim(
+                Subscription.status == "active",
+                Subscription.valid_until.isnot(None),
+                Subscription.valid_until >= start,
+                Subscription.valid_until < end,
+                Subscription.reminded_at.is_(None),
+                order_by=(Subscription.valid_until.asc(),),
+                values={"reminded_at": func.now()},
+                limit=None,
+            )
+
+            async def remind(row) -> bool:
+                display = _display(row)
+                Logger.info("Expiry reminder: sending to user %s, plan=%s, valid_until=%s", display, row.plan_title, row.valid_until)
                 try:
                     await app.bot.send_message(
-                        chat_id=user.tg_user_id,
-                        text=(
-                            f"Подписка «{plan.title}» скоро закончится.\n"
-                            "До окончания осталось около 3 дней.\n\n"
-                            "Продлить сейчас?"
-                        ),
-                        reply_markup=InlineKeyboardMarkup(
-                            [[InlineKeyboardButton("Продлить", callback_data="choose_plan")]]
-                        ),
+                        chat_id=row.tg_user_id,
+                        text=_REMINDER_TEMPLATE.format(row.plan_title),
+                        reply_markup=_RENEW_KB,
                     )
                     Logger.info("Expiry reminder: sent to user %s", display)
                 except Forbidden:
                     Logger.warning("Expiry reminder: user %s blocked the bot, marking as reminded", display)
                 except Exception:
-                    Logger.exception("Failed to send expiry reminder: sub_id=%s", sub.id)
-                    continue
-
-                async def mark_reminded(db):
-                    await db._s.execute(
-                        sa_update(Subscription)
-                        .where(Subscription.id == sub.id)
-                        .values(reminded_at=datetime.now(timezone.utc))
-                    )
-                    await db._s.flush()
+                    Logger.exception("Failed to send expiry reminder: sub_id=%s", row.id)
+                    return False
+                return True
 
-                await db_call(mark_reminded)
+            failed = await _run_concurrently(remind, rows)
+            await _release(failed, reminded_at=None)
         except Exception:
             Logger.exception("expiry_reminder_task failed")
 
@@ -131,54 +260,37 @@ async def expiry_reminder_task(app: Application) -> None:
 
 async def expired_notification_task(app: Application) -> None:
     while True:
+        failed: list[uuid.UUID] = []
+        full = errored = False
         try:
-            async def work(db):
-                stmt = (
-                    select(Subscription, User, Plan)
-                    .join(User, User.id == Subscription.user_id)
-                    .join(Plan, Plan.id == Subscription.plan_id)
-                    .where(
-                        Subscription.status == "expired",
-                        Subscription.notified_expired.is_(False),
-                    )
-                    .order_by(Subscription.valid_until.desc().nullslast())
-                    .limit(100)
-                )
-                res = await db._s.execute(stmt)
-                return list(res.all())
-
-            rows = await db_call(work)
-            for sub, user, plan in rows:
-                display = user.full_name or user.username or str(user.tg_user_id)
-                Logger.info("Expired notification: sending to user %s, plan=%s, valid_until=%s", display, plan.title, sub.valid_until)
+            rows, full = await _claim(
+                Subscription.status == "expired",
+                Subscription.notified_expired.is_(False),
+                order_by=(Subscription.valid_until.desc().nullslast(),),
+                values={"notified_expired": True},
+            )
+
+            async def notify(row) -> bool:
+                display = _display(row)
+                Logger.info("Expired notification: sending to user %s, plan=%s, valid_until=%s", display, row.plan_title, row.valid_until)
                 try:
                     await app.bot.send_message(
-                        chat_id=user.tg_user_id,
-                        text=(
-                            f"Подписка «{plan.title}» закончилась.\n\n"
-                            "Чтобы восстановить доступ, продлите подписку."
-                        ),
-                        reply_markup=InlineKeyboardMarkup(
-                            [[InlineKeyboardButton("Продлить", callback_data="choose_plan")]]
-                        ),
+                        chat_id=row.tg_user_id,
+                        text=_EXPIRED_TEMPLATE.format(row.plan_title),
+                        reply_markup=_RENEW_KB,
                     )
                     Logger.info("Expired notification: sent to user %s", display)
                 except Forbidden:
                     Logger.warning("Expired notification: user %s blocked the bot, marking as notified", display)
                 except Exception:
-                    Logger.exception("Failed to send expired notification: sub_id=%s", sub.id)
-                    continue
-
-                async def mark_notified(db):
-                    await db._s.execute(
-                        sa_update(Subscription)
-                        .where(Subscription.id == sub.id)
-                        .values(notified_expired=True)
-                    )
-                    await db._s.flush()
+                    Logger.exception("Failed to send expired notification: sub_id=%s", row.id)
+                    return False
+                return True
 
-                await db_call(mark_notified)
+            failed = await _run_concurrently(notify, rows)
+            await _release(failed, notified_expired=False)
         except Exception:
             Logger.exception("expired_notification_task failed")
+            errored = True
 
-        await asyncio.sleep(60)
+        await _wait_wakeup(_expired_wakeup, EXPIRED_FALLBACK_SECONDS, failed=bool(failed), errored=errored, full=full)
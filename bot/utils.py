@@ -1,4 +1,4 @@
-from datetime import datetime, timezone
+import time
 from html import escape as html_escape
 from typing import Optional
 
@@ -6,13 +6,21 @@ from typing import Optional
 import base64, hmac, hashlib
 
 REF_SECRET = b"morgan"  # возьми из env
+# Ключ фиксирован: состояние HMAC с уже обработанным ключом копируется на каждую подпись
+_REF_HMAC = hmac.new(REF_SECRET, digestmod=hashlib.sha256)
+
+
+def _ref_sig(msg: bytes) -> bytes:
+    h = _REF_HMAC.copy()
+    h.update(msg)
+    return h.digest()[:10]  # 10 байт хватит
 
 def _b64url(b: bytes) -> str:
     return base64.urlsafe_b64encode(b).decode().rstrip("=")
 
 def make_ref_payload(referrer_tg_id: int) -> str:
     msg = str(referrer_tg_id).encode()
-    sig = hmac.new(REF_SECRET, msg, hashlib.sha256).digest()[:10]  # 10 байт хватит
+    sig = _ref_sig(msg)
     return _b64url(msg + b"." + sig)
 
 def make_ref_link(bot_username: str, referrer_tg_id: int) -> str:
@@ -26,17 +34,27 @@ def parse_ref_payload(payload: str) -> Optional[int]:
     try:
         raw = _b64url_decode(payload)
         msg, sig = raw.split(b".", 1)
-        expected = hmac.new(REF_SECRET, msg, hashlib.sha256).digest()[:10]
+        expected = _ref_sig(msg)
         if not hmac.compare_digest(sig, expected):
             return None
         return int(msg.decode())
     except Exception:
         return None
 
+# (номер дня UTC от эпохи, он же строкой) — strftime только при смене дня
+_day_cache: tuple[int, str] = (-1, "")
+
+
+def _utc_day() -> str:
+    global _day_cache
+    epoch_day = int(time.time()) // 86400
+    if epoch_day != _day_cache[0]:
+        _day_cache = (epoch_day, time.strftime("%Y%m%d", time.gmtime(epoch_day * 86400)))
+    return _day_cache[1]
+
 def idem_key(prefix: str, tg_user_id: int) -> str:
     # идемпотентность на день
-    day = datetime.now(timezone.utc).strftime("%Y%m%d")
-    return f"{prefix}:{tg_user_id}:{day}"
+    return f"{prefix}:{tg_user_id}:{_utc_day()}"
 
 def html_pre(text: str) -> str:
     return f"<pre>{html_escape(text or '')}</pre>"
\ No newline at end of file
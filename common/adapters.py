@@ -2,11 +2,11 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta, date
-from typing import Optional, Iterable
+from typing import AsyncIterator, Optional, Iterable
 import uuid
 
-from sqlalchemy import BigInteger, Column, DateTime, String
-from sqlalchemy import select, update as sa_update, delete, cast, or_, and_, func
+from sqlalchemy import BigInteger, Column, DateTime, Row, RowMapping, String
+from sqlalchemy import bindparam, select, update as sa_update, delete, cast, or_, and_, func, text, tuple_
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -20,32 +20,78 @@ from common.models import (
 )
 
 
+# Горячий путь бота: оператор собирается один раз при импорте, SQLAlchemy
+# переиспользует его скомпилированную форму, а psycopg после нескольких
+# выполнений на соединении переходит на серверный prepared statement.
+_CREATE_OR_REUSE_PENDING_STMT = select(Subscription).from_statement(
+    text(
+        "SELECT * FROM create_or_reuse_pending_subscription("
+        "CAST(:user_id AS uuid), CAST(:plan_id AS uuid), "
+        "CAST(:base_minor AS integer), CAST(:duration_days AS integer))"
+    )
+)
+
+# Частые выборки тоже собраны заранее; значения передаются параметрами
+_USER_BY_TG_STMT = select(User).where(User.tg_user_id == bindparam("tg_user_id"))
+_USER_BY_TOKEN_STMT = select(User).where(User.subscription_token == bindparam("token"))
+_PLAN_BY_CODE_STMT = select(Plan).where(Plan.code == bindparam("code"))
+_ACTIVE_PLANS_STMT = select(Plan).where(Plan.is_active == True).order_by(Plan.created_at.desc())
+
+
 class UsersAdapter:
     def __init__(self, session: AsyncSession):
         self.s = session
 
     async def all(self) -> list[User]:
         res = await self.s.execute(select(User))
-        return list(res.scalars().all())
+        return res.scalars().all()
+
+    # Потоковые выборки через серверный курсор: только нужные колонки, без списка в памяти
+
+    async def iter_ids(self) -> AsyncIterator[uuid.UUID]:
+        res = await self.s.stream_scalars(select(User.id).execution_options(yield_per=500))
+        async for user_id in res:
+            yield user_id
+
+    async def iter_labels(self) -> AsyncIterator[Row]:
+        """Строки (id, full_name, username, tg_user_id) для подписей пользователей."""
+        res = await self.s.stream(
+            select(User.id, User.full_name, User.username, User.tg_user_id)
+            .execution_options(yield_per=500)
+        )
+        async for row in res:
+            yield row
+
+    async def count(self) -> int:
+        res = await self.s.execute(select(func.count()).select_from(User))
+        return int(res.scalar_one())
+
+    async def tg_ids_page(self, *, after: Optional[int] = None, limit: int = 500) -> list[int]:
+        """Страница tg_user_id по возрастанию (keyset по уникальному индексу), начиная после `after`."""
+        stmt = select(User.tg_user_id).order_by(User.tg_user_id).limit(limit)
+        if after is not None:
+            stmt = stmt.where(User.tg_user_id > after)
+        res = await self.s.execute(stmt)
+        return res.scalars().all()
 
     async def byTgId(self, tg_user_id: int) -> Optional[User]:
-        res = await self.s.execute(select(User).where(User.tg_user_id == tg_user_id))
+        res = await self.s.execute(_USER_BY_TG_STMT, {"tg_user_id": tg_user_id})
         return res.scalar_one_or_none()
     
     async def byToken(self, token: str) -> Optional[User]:
-        res = await self.s.execute(select(User).where(User.subscription_token == token))
+        res = await self.s.execute(_USER_BY_TOKEN_STMT, {"token": token})
         return res.scalar_one_or_none()    
         
     async def get(self, user_id: uuid.UUID) -> Optional[User]:
-        res = await self.s.execute(select(User).where(User.id == user_id))
-        return res.scalar_one_or_none()        
+        # Сначала identity map сессии, запрос — только если объекта в ней нет
+        return await self.s.get(User, user_id)
 
     async def by_ids(self, user_ids: Iterable[uuid.UUID]) -> list[User]:
         ids = list(user_ids)
         if not ids:
             return []
         res = await self.s.execute(select(User).where(User.id.in_(ids)))
-        return list(res.scalars().all())
+        return res.scalars().all()
 
     async def getOrCreate(self, tg_user_id: int, username: Optional[str] = None, refer_id: Optional[str] = None, full_name: Optional[str] = None) -> User:
         u = await self.byTgId(tg_user_id)
@@ -58,10 +104,21 @@ class UsersAdapter:
                 await self.s.flush()
             return u
 
-        u = User(tg_user_id=tg_user_id, username=username, refer_id=refer_id, full_name=full_name)
-        self.s.add(u)
-        await self.s.flush()
-        return u
+        # Новый пользователь: один INSERT ... ON CONFLICT ... RETURNING вместо add+flush.
+        # Если параллельный запрос успел создать строку, получаем её же, а не IntegrityError.
+        stmt = insert(User).values(
+            id=uuid.uuid4(),
+            tg_user_id=tg_user_id,
+            username=username,
+            refer_id=refer_id,
+            full_name=full_name,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["tg_user_id"],
+            set_={"full_name": func.coalesce(stmt.excluded.full_name, User.full_name)},
+        ).returning(User)
+        res = await self.s.execute(stmt, execution_options={"populate_existing": True})
+        return res.scalar_one()
     
     async def update(self, user: User) -> User:
         stmt = (
@@ -69,8 +126,8 @@ class UsersAdapter:
             .where(User.id == user.id)
             .values(username=user.username, refer_id=user.refer_id, full_name=user.full_name)
         )
+        # Core UPDATE по первичному ключу уходит сразу, flush здесь не нужен
         await self.s.execute(stmt)
-        await self.s.flush()
         return user
 
     async def delete(self, user_id: uuid.UUID) -> bool:
@@ -96,7 +153,43 @@ class UsersAdapter:
         )
 
         res = await self.s.execute(stmt)
-        return list(res.scalars().all())
+        return res.scalars().all()
+
+    async def access_state(self, user_id: uuid.UUID) -> tuple[Optional[User], bool, bool]:
+        """
+        Одним запросом: (user, есть активная подписка, есть pending free/trial).
+        Если пользователя нет — (None, False, False).
+        """
+        now = datetime.now(timezone.utc)
+
+        has_active = (
+            select(Subscription.id)
+            .where(
+                Subscription.user_id == User.id,
+                Subscription.status == "active",
+                Subscription.valid_from <= now,
+                or_(Subscription.valid_until.is_(None), Subscription.valid_until >= now),
+            )
+            .exists()
+        )
+        has_pending_free_or_trial = (
+            select(Subscription.id)
+            .join(Plan, Plan.id == Subscription.plan_id)
+            .where(
+                Subscription.user_id == User.id,
+                Subscription.status == "pending_payment",
+                Plan.code.in_(["free", "trial"]),
+            )
+            .exists()
+        )
+
+        stmt = select(User, has_active, has_pending_free_or_trial).where(User.id == user_id)
+        res = await self.s.execute(stmt)
+        row = res.first()
+        if row is None:
+            return None, False, False
+        user, active, pending = row
+        return user, bool(active), bool(pending)
 
     async def new_users_last_24h(self) -> list[User]:
         cutoff = datetime.now(timezone.utc) - timedelta(hours=24)
@@ -106,22 +199,31 @@ class UsersAdapter:
             .order_by(User.created_at.desc())
         )
         res = await self.s.execute(stmt)
-        return list(res.scalars().all())
+        return res.scalars().all()
     
-    async def list_with_source_stats(
+    async def list_page(
         self,
         q: Optional[str] = None,
-    ) -> tuple[list[User], list[dict[str, object]]]:
+        limit: int = 50,
+        cursor: Optional[tuple[datetime, uuid.UUID]] = None,
+    ) -> tuple[list[User], Optional[tuple[datetime, uuid.UUID]]]:
         """
         Возвращает:
-          - users: список пользователей (с учётом поиска q), отсортированный по created_at desc
-          - source_stats: агрегат по source для ВСЕХ пользователей (глобально), вида:
-              [{"refer_id": "yndx", "count": 43}, {"refer_id": "—", "count": 8}, ...]
+          - users: страница пользователей (с учётом поиска q), отсортированная по created_at desc
+          - next_cursor: (created_at, id) последнего пользователя страницы,
+              если дальше есть ещё; передаётся в cursor для следующей страницы
         """
         q = (q or "").strip()
 
-        # -------- список пользователей --------
-        stmt = select(User).order_by(User.created_at.desc())
+        # keyset по (created_at, id)
+        stmt = (
+            select(User)
+            .order_by(User.created_at.desc(), User.id.desc())
+            .limit(limit + 1)
+        )
+
+        if cursor is not None:
+            stmt = stmt.where(tuple_(User.created_at, User.id) < cursor)
 
         if q:
             conds = []
@@ -136,22 +238,32 @@ class UsersAdapter:
             stmt = stmt.where(or_(*conds))
 
         res = await self.s.execute(stmt)
-        users = list(res.scalars().all())
+        users = res.scalars().all()
+
+        next_cursor = None
+        if len(users) > limit:
+            users = users[:limit]
+            next_cursor = (users[-1].created_at, users[-1].id)
+
+        return users, next_cursor
 
-        # -------- статистика по source --------
+    async def source_stats(self) -> list[RowMapping]:
+        """
+        Агрегат по source для ВСЕХ пользователей (глобально), вида:
+          [{"refer_id": "yndx", "count": 43}, {"refer_id": "—", "count": 8}, ...]
+        """
+        # Строки уже в нужном виде: шаблону достаточно mappings()
         stats_stmt = (
-            select(User.refer_id, func.count())
+            select(
+                func.coalesce(User.refer_id, "—").label("refer_id"),
+                func.count(User.id).label("count"),
+            )
             .group_by(User.refer_id)
-            .order_by(func.count().desc())
+            .order_by(func.count(User.id).desc())
         )
 
         stats_res = await self.s.execute(stats_stmt)
-        source_stats = [
-            {"refer_id": (src or "—"), "count": cnt}
-            for (src, cnt) in stats_res.all()
-        ]
-
-        return users, source_stats
+        return stats_res.mappings().all()
 
 
 class SubscriptionAdapter:
@@ -201,6 +313,23 @@ class SubscriptionAdapter:
         await self.s.flush()
         return sub
 
+    async def create_or_reuse_pending(self, *, user_id: uuid.UUID, plan: Plan) -> Optional[Subscription]:
+        """
+        Pending-подписка пользователя на план одним вызовом
+        create_or_reuse_pending_subscription() (init_scripts/2026-10-15_pending_subscription_fn.sql).
+        None — если свободных сумм для оплаты не осталось.
+        """
+        res = await self.s.execute(
+            _CREATE_OR_REUSE_PENDING_STMT,
+            {
+                "user_id": user_id,
+                "plan_id": plan.id,
+                "base_minor": int(plan.price_rub) * 100,
+                "duration_days": plan.duration_days,
+            },
+        )
+        return res.scalar_one_or_none()
+
     async def get(self, userId, planId):
         res = await self.s.execute(
             select(Subscription).where(and_(Subscription.user_id == userId, Subscription.plan_id == planId))
@@ -279,6 +408,31 @@ class SubscriptionAdapter:
         res = await self.s.execute(stmt)
         return res.scalar_one_or_none()
 
+    async def active_with_plan(self, user_id: uuid.UUID) -> tuple[Optional[Subscription], Optional[Plan]]:
+        """То же, что active_for_user, но сразу с планом — одним запросом."""
+        now = datetime.now(timezone.utc)
+        stmt = (
+            select(Subscription, Plan)
+            .join(Plan, Plan.id == Subscription.plan_id)
+            .where(
+                Subscription.user_id == user_id,
+                Subscription.status == self.ACTIVE,
+                Subscription.valid_from <= now,
+                or_(Subscription.valid_until.is_(None), Subscription.valid_until >= now),
+            )
+            .order_by(
+                Subscription.valid_until.desc().nullsfirst(),
+                Subscription.valid_from.desc(),
+                Subscription.created_at.desc(),
+            )
+            .limit(1)
+        )
+        res = await self.s.execute(stmt)
+        row = res.first()
+        if row is None:
+            return None, None
+        return row[0], row[1]
+
     async def pending_free_or_trial_for_user(self, user_id: uuid.UUID) -> bool:
         stmt = (
             select(Subscription.id)
@@ -349,18 +503,15 @@ class PlanAdapter:
         self.s = session
         
     async def get(self, plan_id: uuid.UUID) -> Plan | None:
-        res = await self.s.execute(select(Plan).where(Plan.id == plan_id))
-        return res.scalar_one_or_none()
+        return await self.s.get(Plan, plan_id)
 
     async def getByCode(self, code: str) -> Plan:
-        res = await self.s.execute(select(Plan).where(Plan.code == code))
+        res = await self.s.execute(_PLAN_BY_CODE_STMT, {"code": code})
         return res.scalar_one_or_none()
         
     async def active(self) -> list[Plan]:
-        res = await self.s.execute(
-            select(Plan).where(Plan.is_active == True).order_by(Plan.created_at.desc())
-        )
-        return list(res.scalars().all())
+        res = await self.s.execute(_ACTIVE_PLANS_STMT)
+        return res.scalars().all()
 
 class VpnServerAdapter:
     def __init__(self, session: AsyncSession):
@@ -368,11 +519,10 @@ class VpnServerAdapter:
 
     async def all(self) -> list[VpnServer]:
         res = await self.s.execute(select(VpnServer))
-        return list(res.scalars().all())
+        return res.scalars().all()
 
     async def get(self, server_id: uuid.UUID) -> VpnServer | None:
-        res = await self.s.execute(select(VpnServer).where(VpnServer.id == server_id))
-        return res.scalar_one_or_none()
+        return await self.s.get(VpnServer, server_id)
 
     async def create(self, server: VpnServer) -> VpnServer:
         self.s.add(server)
@@ -388,6 +538,9 @@ class VpnServerAdapter:
 
 
 class StatsAdapter:
+    # Строк в одном INSERT: держит размер запроса и число параметров ограниченными
+    UPSERT_CHUNK = 1000
+
     def __init__(self, session: AsyncSession):
         self.s = session
 
@@ -412,7 +565,7 @@ class StatsAdapter:
             .where(UserTrafficSnapshot.day >= start_day, UserTrafficSnapshot.day <= end_day)
         )
         res = await self.s.execute(stmt)
-        return list(res.scalars().all())
+        return res.scalars().all()
 
     async def upsert_user_snapshots(
         self,
@@ -431,15 +584,16 @@ class StatsAdapter:
             }
             for user_id, (total_bytes, daily_bytes) in totals.items()
         ]
-        stmt = insert(UserTrafficSnapshot).values(rows)
-        stmt = stmt.on_conflict_do_update(
-            index_elements=["day", "user_id"],
-            set_={
-                "total_bytes": stmt.excluded.total_bytes,
-                "daily_bytes": stmt.excluded.daily_bytes,
-            },
-        )
-        await self.s.execute(stmt)
+        for i in range(0, len(rows), self.UPSERT_CHUNK):
+            stmt = insert(UserTrafficSnapshot).values(rows[i:i + self.UPSERT_CHUNK])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["day", "user_id"],
+                set_={
+                    "total_bytes": stmt.excluded.total_bytes,
+                    "daily_bytes": stmt.excluded.daily_bytes,
+                },
+            )
+            await self.s.execute(stmt)
         await self.s.flush()
 
     async def upsert_daily_usage(self, day: date, active_users: int, total_bytes: int) -> None:
@@ -461,7 +615,7 @@ class StatsAdapter:
     async def list_daily_usage(self, limit: int = 30) -> list[DailyUsageStat]:
         stmt = select(DailyUsageStat).order_by(DailyUsageStat.day.desc()).limit(limit)
         res = await self.s.execute(stmt)
-        return list(res.scalars().all())
+        return res.scalars().all()
 
 class DbAdapters:
     def __init__(self, session: AsyncSession):
@@ -1,6 +1,7 @@
 import os
 from contextlib import asynccontextmanager
 
+from psycopg.conninfo import make_conninfo
 from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
@@ -22,13 +23,44 @@ DB_PORT = os.environ.get("DB_PORT") or "5432"
 DB_NAME = os.environ.get("DB_NAME") or "app"
 DB_URL = f"{DB_DRIVER}://{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# Пул на процесс; сервисов четыре, так что 4 * (size + overflow) должно
+# помещаться в max_connections Postgres (по умолчанию 100)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE") or "10")
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW") or "10")
+
 engine: AsyncEngine | None = None
 
+
+def make_dsn(username: str, password: str) -> str:
+    """libpq-строка для прямого psycopg-соединения (LISTEN), те же хост/порт/БД, что у engine."""
+    # make_conninfo экранирует пробелы/кавычки в пароле
+    return make_conninfo(
+        dbname=DB_NAME,
+        user=username,
+        password=password,
+        host=DB_HOST,
+        port=DB_PORT,
+    )
+
+
+def _connect_args() -> dict:
+    # Запросы сервисов короткие, JIT для них только тратит время на компиляцию плана
+    if DB_DRIVER.startswith("postgresql+asyncpg"):
+        return {"server_settings": {"jit": "off"}}
+    return {"options": "-c jit=off"}
+
+
 def create_engine_with_credentials(username: str, password: str):
     url = make_url(DB_URL).set(username=username, password=password)
     return create_async_engine(
         url,
         pool_pre_ping=True,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        # старые соединения пересоздаются, LIFO держит в работе небольшое «тёплое» ядро
+        pool_recycle=1800,
+        pool_use_lifo=True,
+        connect_args=_connect_args(),
     )
 
 def init_db_engine(username: str, password: str) -> AsyncEngine:
@@ -37,6 +69,14 @@ def init_db_engine(username: str, password: str) -> AsyncEngine:
     SessionLocal.configure(bind=engine)
     return engine
 
+async def close_engine() -> None:
+    """Закрывает соединения пула при остановке сервиса; дальше нужен новый init_db_engine()."""
+    global engine
+    if engine is None:
+        return
+    await engine.dispose()
+    engine = None
+
 SessionLocal = async_sessionmaker(
     class_=AsyncSession,
     expire_on_commit=False,
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Iterable
+
+import psycopg
+from psycopg import sql
+
+from common.logger import Logger
+
+
+class NotifyPump:
+    """
+    Одно долгоживущее соединение, которое только слушает LISTEN-каналы
+    и складывает полученные Notify в ограниченную очередь. При обрыве переподключается.
+    Разбор и обработка — на стороне потребителей очереди.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        channels: Iterable[str],
+        *,
+        retry_delay: float,
+        queue_maxsize: int = 1024,
+    ) -> None:
+        self._dsn = dsn
+        self._channels = tuple(channels)
+        self._retry_delay = retry_delay
+        self.queue: asyncio.Queue[psycopg.Notify] = asyncio.Queue(maxsize=queue_maxsize)
+
+    async def run(self) -> None:
+        """Работает до отмены задачи."""
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self._dsn, autocommit=True) as conn:
+                    for channel in self._channels:
+                        await conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                    Logger.info("Listening on %s", ", ".join(self._channels))
+
+                    async for notify in conn.notifies():
+                        # очередь полна -> перестаём читать, NOTIFY копятся на стороне сервера
+                        await self.queue.put(notify)
+            except Exception:
+                Logger.exception("LISTEN on %s failed", ", ".join(self._channels))
+                await asyncio.sleep(self._retry_delay)
+
+    async def get_batch(self, max_size: int) -> list[psycopg.Notify]:
+        """Дождаться хотя бы одного Notify и забрать всё уже накопившееся (не больше max_size)."""
+        batch = [await self.queue.get()]
+        while len(batch) < max_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
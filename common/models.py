@@ -10,6 +10,7 @@ from sqlalchemy import (
     Date,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
     func
@@ -63,9 +64,13 @@ class User(SQLModel, table=True):
 
     subscriptions: list["Subscription"] = Relationship(
         back_populates="user",
+        # Связи не подгружаются сами: кому нужны, берут selectinload явно.
+        # Подписки удаляет ON DELETE CASCADE в БД, поэтому при удалении
+        # пользователя коллекцию не загружаем (passive_deletes).
         sa_relationship_kwargs={
             "cascade": "all, delete-orphan",
-            "lazy": "selectin",
+            "lazy": "raise_on_sql",
+            "passive_deletes": True,
         },
     )
 
@@ -99,7 +104,7 @@ class Plan(SQLModel, table=True):
 
     subscriptions: list["Subscription"] = Relationship(
         back_populates="plan",
-        sa_relationship_kwargs={"lazy": "selectin"},
+        sa_relationship_kwargs={"lazy": "raise_on_sql"},
     )
 
 class SubscriptionStatus(str, enum.Enum):
@@ -118,6 +123,8 @@ pg_status_enum = ENUM(
 
 class Subscription(SQLModel, table=True):
     __tablename__ = "subscriptions"
+    # (user_id, plan_id) заменяет отдельный индекс по user_id: ведущая колонка та же
+    __table_args__ = (Index("idx_subs_user_plan", "user_id", "plan_id"),)
 
     id: uuid.UUID = Field(
         default_factory=uuid.uuid4,
@@ -129,7 +136,6 @@ class Subscription(SQLModel, table=True):
             PG_UUID(as_uuid=True),
             ForeignKey("users.id", ondelete="CASCADE"),
             nullable=False,
-            index=True,
         )
     )
 
@@ -177,8 +183,8 @@ class Subscription(SQLModel, table=True):
         sa_column=Column(Boolean, nullable=False, server_default="false"),
     )
 
-    user: "User" = Relationship(back_populates="subscriptions", sa_relationship_kwargs={"lazy": "selectin"})
-    plan: "Plan" = Relationship(back_populates="subscriptions", sa_relationship_kwargs={"lazy": "selectin"})
+    user: "User" = Relationship(back_populates="subscriptions", sa_relationship_kwargs={"lazy": "raise_on_sql"})
+    plan: "Plan" = Relationship(back_populates="subscriptions", sa_relationship_kwargs={"lazy": "raise_on_sql"})
 
 class Base(DeclarativeBase):
     pass
@@ -0,0 +1,8 @@
+-- Partial index for "active subscription right now" lookups
+-- (UsersAdapter.active_subscription_users, access_state, active_for_user).
+-- Only active rows are indexed; expired/pending history is skipped.
+-- Run under migration/DBA role.
+
+CREATE INDEX IF NOT EXISTS idx_subs_active_window
+ON subscriptions (user_id, valid_from, valid_until)
+WHERE status = 'active';
@@ -0,0 +1,8 @@
+-- Index matching SubscriptionAdapter.last_for_user ORDER BY, so the latest
+-- active/pending subscription of a user is read by an index scan + LIMIT 1
+-- instead of a sort.
+-- Run under migration/DBA role.
+
+CREATE INDEX IF NOT EXISTS idx_subs_user_last
+ON subscriptions (user_id, valid_until DESC NULLS FIRST, valid_from DESC, created_at DESC)
+WHERE status IN ('active', 'pending_payment');
@@ -0,0 +1,15 @@
+-- Partial indexes for the bot's subscription notifiers (bot/subscription_tasks.py).
+-- Each covers only rows still waiting for a notification, so they stay small.
+-- Run under migration/DBA role.
+
+CREATE INDEX IF NOT EXISTS ix_subs_overdue_unnotified
+ON subscriptions (created_at)
+WHERE status = 'payment_overdue' AND notified_overdue = FALSE;
+
+CREATE INDEX IF NOT EXISTS ix_subs_expiring_unreminded
+ON subscriptions (valid_until)
+WHERE status = 'active' AND reminded_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_subs_expired_unnotified
+ON subscriptions (valid_until DESC NULLS LAST)
+WHERE status = 'expired' AND notified_expired = FALSE;
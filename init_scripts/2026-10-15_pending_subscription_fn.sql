@@ -0,0 +1,85 @@
+-- Atomic "reuse / cancel / create" of a pending_payment subscription for the bot.
+-- Run under migration/DBA role.
+--
+-- Returns the pending subscription for (user, plan): the existing one if it is for
+-- the same plan, otherwise cancels the other pending one and inserts a new row with
+-- the first free expected_amount_minor in base+1..base+99, then base+101..base+199.
+-- Returns no rows when no free amount is left.
+
+CREATE OR REPLACE FUNCTION create_or_reuse_pending_subscription(
+  p_user_id UUID,
+  p_plan_id UUID,
+  p_base_minor INTEGER,
+  p_duration_days INTEGER
+)
+RETURNS SETOF subscriptions AS $$
+DECLARE
+  v_existing subscriptions%ROWTYPE;
+  v_sub subscriptions%ROWTYPE;
+  v_start TIMESTAMPTZ;
+  v_until TIMESTAMPTZ;
+  v_amount INTEGER;
+BEGIN
+  SELECT * INTO v_existing
+  FROM subscriptions
+  WHERE user_id = p_user_id
+    AND status = 'pending_payment'
+  ORDER BY created_at DESC
+  LIMIT 1
+  FOR UPDATE;
+
+  IF FOUND THEN
+    IF v_existing.plan_id = p_plan_id THEN
+      RETURN NEXT v_existing;
+      RETURN;
+    END IF;
+
+    UPDATE subscriptions
+    SET status = 'canceled', updated_at = now()
+    WHERE id = v_existing.id;
+  END IF;
+
+  -- новая подписка начинается после окончания текущей активной
+  SELECT GREATEST(now(), max(valid_until)) INTO v_start
+  FROM subscriptions
+  WHERE user_id = p_user_id
+    AND status = 'active'
+    AND valid_until IS NOT NULL;
+
+  IF p_duration_days IS NOT NULL THEN
+    v_until := v_start + make_interval(days => p_duration_days);
+  END IF;
+
+  FOR attempt IN 1..5 LOOP
+    SELECT g INTO v_amount
+    FROM generate_series(p_base_minor + 1, p_base_minor + 199) AS g
+    WHERE g <> p_base_minor + 100
+      AND NOT EXISTS (
+        SELECT 1
+        FROM subscriptions s
+        WHERE s.status = 'pending_payment'
+          AND s.expected_amount_minor = g
+      )
+    ORDER BY g
+    LIMIT 1;
+
+    IF v_amount IS NULL THEN
+      RETURN;
+    END IF;
+
+    BEGIN
+      INSERT INTO subscriptions (id, user_id, plan_id, expected_amount_minor, status, valid_from, valid_until)
+      VALUES (gen_random_uuid(), p_user_id, p_plan_id, v_amount, 'pending_payment', v_start, v_until)
+      RETURNING * INTO v_sub;
+
+      RETURN NEXT v_sub;
+      RETURN;
+    EXCEPTION WHEN unique_violation THEN
+      -- сумму занял параллельный запрос (idx_pending_amount) — берём следующую
+      NULL;
+    END;
+  END LOOP;
+
+  RETURN;
+END;
+$$ LANGUAGE plpgsql;
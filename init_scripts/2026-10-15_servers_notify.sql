@@ -0,0 +1,17 @@
+-- Notify access_sync when VPN server rows change, so it re-syncs its xui clients
+-- only when needed instead of on every periodic run.
+-- Run under migration/DBA role.
+
+CREATE OR REPLACE FUNCTION vpn_servers_notify_change()
+RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('servers_changed', '');
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS vpn_servers_notify_change ON vpn_servers;
+CREATE TRIGGER vpn_servers_notify_change
+AFTER INSERT OR UPDATE OR DELETE ON vpn_servers
+FOR EACH STATEMENT
+EXECUTE FUNCTION vpn_servers_notify_change();
@@ -0,0 +1,9 @@
+-- Composite index for lookups by (user_id, plan_id). Its leading column is
+-- user_id, so it also serves every user_id-only lookup (including the
+-- ON DELETE CASCADE from users) and replaces ix_subscriptions_user_id.
+-- Run under migration/DBA role.
+
+CREATE INDEX IF NOT EXISTS idx_subs_user_plan
+ON subscriptions (user_id, plan_id);
+
+DROP INDEX IF EXISTS ix_subscriptions_user_id;
@@ -0,0 +1,38 @@
+-- subscriptions_changed payload gains the status transition, so the bot can
+-- wake its overdue/expired notifiers only when a row enters those statuses.
+-- Updates that touch only the bot's notification marks (notified_*,
+-- reminded_at) no longer notify: they do not change anyone's access.
+-- The trigger itself is unchanged. Run under migration/DBA role.
+
+CREATE OR REPLACE FUNCTION subscriptions_notify_change()
+RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    PERFORM pg_notify(
+      'subscriptions_changed',
+      json_build_object('user_id', OLD.user_id)::text
+    );
+    RETURN OLD;
+  END IF;
+
+  -- отметки уведомлений бота (notified_*, reminded_at) доступ не меняют
+  IF TG_OP = 'UPDATE'
+     AND NEW.status IS NOT DISTINCT FROM OLD.status
+     AND NEW.valid_from IS NOT DISTINCT FROM OLD.valid_from
+     AND NEW.valid_until IS NOT DISTINCT FROM OLD.valid_until
+     AND NEW.plan_id = OLD.plan_id
+     AND NEW.user_id = OLD.user_id THEN
+    RETURN NEW;
+  END IF;
+
+  PERFORM pg_notify(
+    'subscriptions_changed',
+    json_build_object(
+      'user_id', NEW.user_id,
+      'status', NEW.status,
+      'old_status', CASE WHEN TG_OP = 'UPDATE' THEN OLD.status END
+    )::text
+  );
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,6 @@
+-- Users are listed newest first (admin user list, active_subscription_users).
+-- id is the tiebreaker for keyset pagination on (created_at, id).
+-- Run under migration/DBA role.
+
+CREATE INDEX IF NOT EXISTS idx_users_created_at_desc
+ON users (created_at DESC, id DESC);
@@ -0,0 +1,15 @@
+-- Trigram indexes for the admin user search (UsersAdapter.list_page):
+-- ILIKE '%q%' on username / refer_id / token can use them instead of a seq scan.
+-- The token expression matches CAST(subscription_token AS VARCHAR) in the query.
+-- Run under migration/DBA role (CREATE EXTENSION).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_users_username_trgm
+ON users USING gin (username gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_users_refer_trgm
+ON users USING gin (refer_id gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_users_token_trgm
+ON users USING gin ((subscription_token::varchar) gin_trgm_ops);
@@ -208,7 +208,8 @@ ALTER DEFAULT PRIVILEGES IN SCHEMA public GRANT USAGE, SELECT, UPDATE ON SEQUENC
 ALTER DEFAULT PRIVILEGES FOR ROLE :"db_owner" IN SCHEMA public GRANT SELECT, INSERT, UPDATE ON TABLES TO sub_creator, sub_verifier, sub_reader;
 ALTER DEFAULT PRIVILEGES FOR ROLE :"db_owner" IN SCHEMA public GRANT USAGE, SELECT, UPDATE ON SEQUENCES TO sub_creator, sub_verifier, sub_reader;
 
--- 5) Notify on subscription changes (access_sync listener)
+-- 5) Notify on subscription changes (access_sync listener, bot notifiers)
+-- (см. 2026-10-15_subscriptions_notify_status.sql)
 CREATE OR REPLACE FUNCTION subscriptions_notify_change()
 RETURNS trigger AS $$
 BEGIN
@@ -220,9 +221,23 @@ BEGIN
     RETURN OLD;
   END IF;
 
+  -- отметки уведомлений бота (notified_*, reminded_at) доступ не меняют
+  IF TG_OP = 'UPDATE'
+     AND NEW.status IS NOT DISTINCT FROM OLD.status
+     AND NEW.valid_from IS NOT DISTINCT FROM OLD.valid_from
+     AND NEW.valid_until IS NOT DISTINCT FROM OLD.valid_until
+     AND NEW.plan_id = OLD.plan_id
+     AND NEW.user_id = OLD.user_id THEN
+    RETURN NEW;
+  END IF;
+
   PERFORM pg_notify(
     'subscriptions_changed',
-    json_build_object('user_id', NEW.user_id)::text
+    json_build_object(
+      'user_id', NEW.user_id,
+      'status', NEW.status,
+      'old_status', CASE WHEN TG_OP = 'UPDATE' THEN OLD.status END
+    )::text
   );
   RETURN NEW;
 END;
@@ -233,3 +248,143 @@ CREATE TRIGGER subscriptions_notify_change
 AFTER INSERT OR UPDATE OR DELETE ON subscriptions
 FOR EACH ROW
 EXECUTE FUNCTION subscriptions_notify_change();
+
+-- 5.1) Notify on vpn_servers changes (access_sync listener)
+CREATE OR REPLACE FUNCTION vpn_servers_notify_change()
+RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('servers_changed', '');
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS vpn_servers_notify_change ON vpn_servers;
+CREATE TRIGGER vpn_servers_notify_change
+AFTER INSERT OR UPDATE OR DELETE ON vpn_servers
+FOR EACH STATEMENT
+EXECUTE FUNCTION vpn_servers_notify_change();
+
+-- 6) Pending-подписка для бота одним вызовом (см. 2026-10-15_pending_subscription_fn.sql)
+CREATE OR REPLACE FUNCTION create_or_reuse_pending_subscription(
+  p_user_id UUID,
+  p_plan_id UUID,
+  p_base_minor INTEGER,
+  p_duration_days INTEGER
+)
+RETURNS SETOF subscriptions AS $$
+DECLARE
+  v_existing subscriptions%ROWTYPE;
+  v_sub subscriptions%ROWTYPE;
+  v_start TIMESTAMPTZ;
+  v_until TIMESTAMPTZ;
+  v_amount INTEGER;
+BEGIN
+  SELECT * INTO v_existing
+  FROM subscriptions
+  WHERE user_id = p_user_id
+    AND status = 'pending_payment'
+  ORDER BY created_at DESC
+  LIMIT 1
+  FOR UPDATE;
+
+  IF FOUND THEN
+    IF v_existing.plan_id = p_plan_id THEN
+      RETURN NEXT v_existing;
+      RETURN;
+    END IF;
+
+    UPDATE subscriptions
+    SET status = 'canceled', updated_at = now()
+    WHERE id = v_existing.id;
+  END IF;
+
+  -- новая подписка начинается после окончания текущей активной
+  SELECT GREATEST(now(), max(valid_until)) INTO v_start
+  FROM subscriptions
+  WHERE user_id = p_user_id
+    AND status = 'active'
+    AND valid_until IS NOT NULL;
+
+  IF p_duration_days IS NOT NULL THEN
+    v_until := v_start + make_interval(days => p_duration_days);
+  END IF;
+
+  FOR attempt IN 1..5 LOOP
+    SELECT g INTO v_amount
+    FROM generate_series(p_base_minor + 1, p_base_minor + 199) AS g
+    WHERE g <> p_base_minor + 100
+      AND NOT EXISTS (
+        SELECT 1
+        FROM subscriptions s
+        WHERE s.status = 'pending_payment'
+          AND s.expected_amount_minor = g
+      )
+    ORDER BY g
+    LIMIT 1;
+
+    IF v_amount IS NULL THEN
+      RETURN;
+    END IF;
+
+    BEGIN
+      INSERT INTO subscriptions (id, user_id, plan_id, expected_amount_minor, status, valid_from, valid_until)
+      VALUES (gen_random_uuid(), p_user_id, p_plan_id, v_amount, 'pending_payment', v_start, v_until)
+      RETURNING * INTO v_sub;
+
+      RETURN NEXT v_sub;
+      RETURN;
+    EXCEPTION WHEN unique_violation THEN
+      -- сумму занял параллельный запрос (idx_pending_amount) — берём следующую
+      NULL;
+    END;
+  END LOOP;
+
+  RETURN;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 7) Частичные индексы для уведомлений бота (см. 2026-10-15_notifier_indexes.sql)
+CREATE INDEX IF NOT EXISTS ix_subs_overdue_unnotified
+ON subscriptions (created_at)
+WHERE status = 'payment_overdue' AND notified_overdue = FALSE;
+
+CREATE INDEX IF NOT EXISTS ix_subs_expiring_unreminded
+ON subscriptions (valid_until)
+WHERE status = 'active' AND reminded_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_subs_expired_unnotified
+ON subscriptions (valid_until DESC NULLS LAST)
+WHERE status = 'expired' AND notified_expired = FALSE;
+
+-- 8) Активные подписки по окну действия (см. 2026-10-15_active_window_index.sql)
+CREATE INDEX IF NOT EXISTS idx_subs_active_window
+ON subscriptions (user_id, valid_from, valid_until)
+WHERE status = 'active';
+
+-- 9) Последняя подписка пользователя (см. 2026-10-15_last_subscription_index.sql)
+CREATE INDEX IF NOT EXISTS idx_subs_user_last
+ON subscriptions (user_id, valid_until DESC NULLS FIRST, valid_from DESC, created_at DESC)
+WHERE status IN ('active', 'pending_payment');
+
+-- 10) Список пользователей по дате создания (см. 2026-10-15_users_created_at_index.sql)
+CREATE INDEX IF NOT EXISTS idx_users_created_at_desc
+ON users (created_at DESC, id DESC);
+
+-- 11) Поиск пользователей в админке по подстроке (см. 2026-10-15_users_search_trgm.sql)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_users_username_trgm
+ON users USING gin (username gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_users_refer_trgm
+ON users USING gin (refer_id gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_users_token_trgm
+ON users USING gin ((subscription_token::varchar) gin_trgm_ops);
+
+-- 12) Подписки по (user_id, plan_id) вместо индекса по user_id (см. 2026-10-15_subs_user_plan_index.sql)
+CREATE INDEX IF NOT EXISTS idx_subs_user_plan
+ON subscriptions (user_id, plan_id);
+
+-- старый индекс от index=True в модели: его покрывает ведущая колонка idx_subs_user_plan
+DROP INDEX IF EXISTS ix_subscriptions_user_id;
@@ -3,7 +3,7 @@ import os
 import traceback
 from sqlmodel import SQLModel
 
-from common.db import init_db_engine
+from common.db import close_engine, init_db_engine
 from common.models import User  # noqa: F401
 
 
@@ -13,8 +13,11 @@ async def main() -> None:
 
 
     engine = init_db_engine(user, pwd)
-    async with engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.create_all)
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+    finally:
+        await close_engine()
 
 
 if __name__ == "__main__":
@@ -2,7 +2,7 @@ import asyncio
 import os
 import signal
 
-from common.db import init_db_engine
+from common.db import close_engine, init_db_engine
 from common.logger import Level, Logger
 from pay_verifier.config import load_config
 from pay_verifier.matchers import VkSbpMatcher
@@ -39,7 +39,10 @@ def main() -> None:
         loop = asyncio.get_running_loop()
         for sig in (signal.SIGINT, signal.SIGTERM):
             loop.add_signal_handler(sig, stop_event.set)
-        await service.run_forever(stop_event)
+        try:
+            await service.run_forever(stop_event)
+        finally:
+            await close_engine()
 
     asyncio.run(_run())
 
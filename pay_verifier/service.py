@@ -98,7 +98,7 @@ class PaymentPollingService:
                 .order_by(Subscription.created_at.asc())
             )
             res = await db._s.execute(stmt)
-            return list(res.scalars().all())
+            return res.scalars().all()
 
         return await db_call(work)
 
@@ -28,7 +28,7 @@ async def plans_page(request: Request, q: Optional[str] = None) -> HTMLResponse:
             like = f"%{q}%"
             stmt = stmt.where(or_(Plan.code.ilike(like), Plan.title.ilike(like)))
         res = await db._s.execute(stmt)
-        return list(res.scalars().all())
+        return res.scalars().all()
 
     plans = await db_call(_load)
 
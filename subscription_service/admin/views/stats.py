@@ -15,6 +15,10 @@ templates = Jinja2Templates(directory="subscription_service/admin/templates")
 GB = 1024 * 1024 * 1024
 
 
+async def _user_labels(db) -> dict[uuid.UUID, str]:
+    return {u.id: (u.full_name or u.username or str(u.tg_user_id)) async for u in db.users.iter_labels()}
+
+
 @router.get("/stats", response_class=HTMLResponse)
 async def stats_page(request: Request):
     return await stats_users_page(request)
@@ -25,8 +29,7 @@ async def stats_users_page(request: Request):
     server_manager = request.app.state.serverManager
     live = await server_manager.collect_user_traffic()
     label_map = await server_manager.collect_user_labels()
-    users = await db_call(lambda db: db.users.all())
-    user_labels = {u.id: (u.full_name or u.username or str(u.tg_user_id)) for u in users}
+    user_labels = await db_call(_user_labels)
     for user_id, label in label_map.items():
         if user_id not in user_labels and label:
             user_labels[user_id] = f"{label} NOT-DB"
@@ -58,9 +61,7 @@ async def stats_users_page(request: Request):
 
     current_map = await db_call(lambda db: db.stats.user_snapshot_map(latest_day))
     snapshots = await db_call(lambda db: db.stats.user_snapshots_range(start_day, latest_day))
-    users = await db_call(lambda db: db.users.all())
-
-    user_labels = {u.id: (u.full_name or u.username or str(u.tg_user_id)) for u in users}
+    user_labels = await db_call(_user_labels)
     label_map = await request.app.state.serverManager.collect_user_labels()
     for user_id, label in label_map.items():
         if user_id not in user_labels and label:
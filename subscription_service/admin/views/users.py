@@ -1,36 +1,68 @@
 from __future__ import annotations
 
+import asyncio
 import uuid
+from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter, Request, Form
+from fastapi import APIRouter, BackgroundTasks, Request, Form
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy import select, update, delete, or_, cast, String
 from urllib.parse import quote
 
 from common.db import db_call
+from common.logger import Logger
 from common.models import User
 from common.xui_client.registry import Manager
 
 router = APIRouter()
 templates = Jinja2Templates(directory="subscription_service/admin/templates")
 
+
+async def _sync_user_safe(serverManager: Manager, user: User) -> None:
+    try:
+        await serverManager.sync_user(user)
+    except Exception:
+        Logger.exception("Background sync_user failed for user %s", user.id)
+
+USERS_PAGE_SIZE = 50
+
+
+def _parse_cursor(after: Optional[str]) -> Optional[tuple[datetime, uuid.UUID]]:
+    # формат: "<created_at isoformat>_<id>"
+    if not after:
+        return None
+    try:
+        ts, _, user_id = after.rpartition("_")
+        return datetime.fromisoformat(ts), uuid.UUID(user_id)
+    except ValueError:
+        return None
+
+
 @router.get("/users", response_class=HTMLResponse)
-async def users_page(request: Request, q: Optional[str] = None) -> HTMLResponse:
-    users, source_stats = await db_call(lambda db:  db.users.list_with_source_stats(q=q))
+async def users_page(request: Request, q: Optional[str] = None, after: Optional[str] = None) -> HTMLResponse:
+    cursor = _parse_cursor(after)
+    # Страница и статистика независимы: два запроса в двух сессиях параллельно
+    (users, next_cursor), source_stats = await asyncio.gather(
+        db_call(lambda db: db.users.list_page(q=q, limit=USERS_PAGE_SIZE, cursor=cursor)),
+        db_call(lambda db: db.users.source_stats()),
+    )
+    next_after = f"{next_cursor[0].isoformat()}_{next_cursor[1]}" if next_cursor else None
 
     return templates.TemplateResponse(
         "users.html",
         {"request": request, 
          "users": users, 
          "q": (q or "").strip(), 
-         "source_stats": source_stats},
+         "source_stats": source_stats,
+         "next_after": next_after},
     )
 
 @router.post("/users/create")
 async def user_create(
     request: Request,
+    background_tasks: BackgroundTasks,
     tg_user_id: int = Form(...),
     username: Optional[str] = Form(default=None),
     refer_id: Optional[str] = Form(default=None),
@@ -55,9 +87,10 @@ async def user_create(
         return user
 
     user = await db_call(_create)
-    
+
+    # Синхронизация с x-ui идёт после ответа, чтобы редирект не ждал серверы
     serverManager: Manager = request.app.state.serverManager
-    await   serverManager.sync_user(user)
+    background_tasks.add_task(_sync_user_safe, serverManager, user)
     return RedirectResponse(url=f"/admin/users/{user.id}", status_code=303)
 
 
@@ -82,16 +115,20 @@ async def user_update(
     username = (username or "").strip() or None
     refer_id = (refer_id or "").strip() or None
 
-    user: User = await db_call(lambda db: db.users.get(user_id))
+    async def _update(db) -> User | None:
+        # Меняем загруженный объект: при коммите flush выдаст UPDATE по id только изменённых полей
+        user = await db.users.get(user_id)
+        if user is not None:
+            user.refer_id = refer_id
+            user.username = username
+        return user
+
+    user: User = await db_call(_update)
     if not user:
         return RedirectResponse(
             "/admin/users?err=Пользователь не найден",
             status_code=303,
         )
-
-    user.refer_id = refer_id
-    user.username = username
-    user = await db_call(lambda db: db.users.update(user=user))
         
     # На серверах не меняем !!!!                   <=================================
     # try:
@@ -9,7 +9,7 @@ from fastapi import FastAPI, Response, Request
 from urllib.parse import quote
 
 from common.models import User
-from common.db import db_call, init_db_engine
+from common.db import close_engine, db_call, init_db_engine
 from common.logger import Logger, Level
 from common.xui_client.registry import Manager
 from subscription_service.stats import daily_stats_task
@@ -33,6 +33,7 @@ async def lifespan(app: FastAPI):
         await task
     except asyncio.CancelledError:
         pass
+    await close_engine()
     # при необходимости: app.state.serverManager.close() / cleanup
 
 app = FastAPI(title="Subscription service", lifespan=lifespan)
@@ -15,6 +15,10 @@ def _today_local() -> date:
     return datetime.now(TZ).date()
 
 
+async def _user_ids(db) -> set:
+    return {user_id async for user_id in db.users.iter_ids()}
+
+
 async def collect_daily_usage(server_manager: Manager, *, snapshot_day: date | None = None) -> None:
     """
     Снимает снапшоты и считает суточное потребление.
@@ -26,8 +30,7 @@ async def collect_daily_usage(server_manager: Manager, *, snapshot_day: date | N
     current_snapshot = await db_call(lambda db: db.stats.user_snapshot_map(snap_day))
     if not current_snapshot:
         current_snapshot = await server_manager.collect_user_traffic()
-        users = await db_call(lambda db: db.users.all())
-        known_ids = {u.id for u in users}
+        known_ids = await db_call(_user_ids)
         filtered_snapshot = {
             user_id: traffic
             for user_id, traffic in current_snapshot.items()